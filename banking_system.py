@@ -1,21 +1,223 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime
-import json
-import os
+from collections import OrderedDict
+import argparse
+import queue
+import sys
+from contextlib import nullcontext
+import metrics
+from bulk import FORMATS, export_statements, guess_format, import_transactions
+from ledger import Ledger, LedgerError
+from money import format_amount, format_rupees
+from stats import average_balance
+from columns import TYPE_NAMES
+from server import LedgerClient, parse_address
+from storage import add_storage_arguments, open_storage, storage_from_args
+from writer import BackgroundWriter
+
+class HistoryView:
+    """Transaction list that keeps a fixed set of Treeview rows and refills them from cached pages
+    
+    Opening it costs the same for ten transactions or a million: only the
+    visible rows are created, and pages of PAGE_SIZE transactions are fetched
+    from the ledger (sorted by the storage backend) as the user scrolls.
+    
+    Counts and pages are read through read(callback, function, *args), off
+    the Tk loop, one page at a time; rows whose page is still on its way
+    show "Loading…".
+    """
+    
+    PAGE_SIZE = 100
+    MAX_CACHED_PAGES = 8
+    COLUMNS = ('Date', 'Type', 'Amount', 'Balance')
+    
+    def __init__(self, parent, ledger, username, read, rows=15):
+        self.ledger = ledger
+        self.username = username
+        self.read = read
+        self.rows = rows
+        self.offset = 0
+        self.sort = 'date'
+        self.descending = True  # Show most recent first
+        self.pages = OrderedDict()
+        self.filters = None
+        self.total = 0
+        self.loading = False
+        # Bumped whenever the ordering or filters change, so late pages are dropped
+        self.generation = 0
+        # Bumped for each count, so only the latest one is applied
+        self.counting = 0
+        
+        self.tree = ttk.Treeview(parent, columns=self.COLUMNS, show='headings',
+                                 height=rows, selectmode='none')
+        for col in self.COLUMNS:
+            self.tree.heading(col, text=col, command=lambda key=col.lower(): self.sort_by(key))
+            if col == 'Date':
+                self.tree.column(col, width=150)
+            elif col == 'Type':
+                self.tree.column(col, width=120)
+            else:
+                self.tree.column(col, width=100)
+        
+        self.scrollbar = ttk.Scrollbar(parent, orient='vertical', command=self.on_scroll)
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+        
+        self.items = [self.tree.insert('', 'end') for _ in range(rows)]
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(sequence, self.on_wheel)
+        self.refresh()
+    
+    def row(self, index):
+        """Return the transaction at a position of the current ordering, or None while its page loads"""
+        page_number, position = divmod(index, self.PAGE_SIZE)
+        page = self.pages.get(page_number)
+        if page is None:
+            self.fetch(page_number)
+            return None
+        self.pages.move_to_end(page_number)
+        return page[position]
+    
+    def fetch(self, page_number):
+        """Read a page in the background, unless one is already on its way"""
+        if self.loading:
+            return
+        self.loading = True
+        generation = self.generation
+        self.read(lambda future: self.fetched(future, page_number, generation),
+                  self.ledger.history, self.username, page_number * self.PAGE_SIZE,
+                  self.PAGE_SIZE, self.sort, self.descending, self.filters)
+    
+    def fetched(self, future, page_number, generation):
+        """Cache a page read in the background and refill the rows, which may fetch the next one"""
+        self.loading = False
+        if not self.tree.winfo_exists():
+            return
+        try:
+            page = future.result()
+        except (LedgerError, OSError) as e:
+            # Scrolling asks for the page again
+            messagebox.showerror("Error", f"Failed to load transactions: {str(e)}")
+            return
+        if generation == self.generation:
+            self.pages[page_number] = page
+            if len(self.pages) > self.MAX_CACHED_PAGES:
+                self.pages.popitem(last=False)
+        self.refresh()
+    
+    def refresh(self):
+        """Fill the visible rows from the current offset and update scrollbar and headings"""
+        for i, item in enumerate(self.items):
+            index = self.offset + i
+            values = ('', '', '', '')
+            if index < self.total:
+                transaction = self.row(index)
+                if transaction is None:
+                    values = ("⏳ Loading…", '', '', '')
+                else:
+                    values = (transaction['date'], transaction['type'],
+                              format_amount(transaction['amount']), format_amount(transaction['balance']))
+            self.tree.item(item, values=values)
+        
+        if self.total:
+            self.scrollbar.set(self.offset / self.total,
+                               min(1.0, (self.offset + self.rows) / self.total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        
+        for col in self.COLUMNS:
+            arrow = (" ▼" if self.descending else " ▲") if col.lower() == self.sort else ""
+            self.tree.heading(col, text=col + arrow)
+    
+    def scroll_to(self, offset):
+        """Move the first visible row to an offset, clamped to the history"""
+        self.offset = max(0, min(offset, self.total - self.rows))
+        self.refresh()
+    
+    def on_scroll(self, action, value, unit=None):
+        """Handle scrollbar drags, arrow clicks and trough clicks"""
+        if action == 'moveto':
+            self.scroll_to(int(float(value) * self.total))
+        elif action == 'scroll':
+            step = self.rows if unit == 'pages' else 1
+            self.scroll_to(self.offset + int(value) * step)
+    
+    def on_wheel(self, event):
+        """Scroll three rows per mouse wheel notch"""
+        up = event.num == 4 or event.delta > 0
+        self.scroll_to(self.offset + (-3 if up else 3))
+        return 'break'
+    
+    def sort_by(self, key):
+        """Sort by a column on the storage side; clicking the same column again flips the order"""
+        if key == self.sort:
+            self.descending = not self.descending
+        else:
+            self.sort = key
+            self.descending = False
+        self.generation += 1
+        self.pages.clear()
+        self.offset = 0
+        self.refresh()
+    
+    def set_filters(self, filters, callback):
+        """Count the transactions matching filters in the background, then show only those
+        
+        callback(error) runs on the Tk loop afterwards, with None or with the
+        LedgerError or OSError that rejected the filters. A count overtaken
+        by a newer one is dropped without calling it.
+        """
+        self.counting += 1
+        counting = self.counting
+        
+        def counted(future):
+            if counting != self.counting or not self.tree.winfo_exists():
+                return
+            try:
+                total = future.result()
+            except (LedgerError, OSError) as e:
+                callback(e)
+                return
+            self.total = total
+            self.filters = filters
+            self.generation += 1
+            self.pages.clear()
+            self.offset = 0
+            self.refresh()
+            callback(None)
+        
+        self.read(counted, self.ledger.transaction_count, self.username, filters)
 
 class BankingSystem:
-    def __init__(self):
-        self.users = {}
+    # How often the Tk loop checks on background work, in milliseconds
+    POLL_MS = 20
+    
+    def __init__(self, ledger=None):
         self.current_user = None
-        self.data_file = "banking_data.json"
+        self.login_pending = False
+        self.ledger = ledger if ledger is not None else Ledger(open_storage("json"))
         self.load_data()
         
+        # Writes, and the reads that refresh the screen after them, run here so
+        # a slow disk or server never blocks the Tk main loop
+        self.writer = BackgroundWriter(name="ui-writer")
+        # Other reads run on a second thread, so they never wait behind queued writes
+        self.reader = BackgroundWriter(name="ui-reader")
+        # Bumped by each refresh from the writer, so an older background read is not shown over it
+        self.account_version = 0
+        self.saving = False
+        self.write_buttons = []
+        self.saving_label = None
+        self.confirm_btn = None
+        self.create_btn = None
+        
         # Create main window
         self.root = tk.Tk()
         self.root.title("💳 Online Banking System")
         self.root.geometry("900x650")
         self.root.configure(bg="#f8f9fa")
+        self.root.protocol("WM_DELETE_WINDOW", self.close_window)
         
         # Style configuration
         self.style = ttk.Style()
@@ -24,21 +226,39 @@ class BankingSystem:
         self.create_login_screen()
     
     def load_data(self):
-        """Load user data from JSON file"""
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r') as f:
-                    self.users = json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                self.users = {}
+        """Load user data from the storage backend or connect to the server"""
+        self.ledger.load()
     
-    def save_data(self):
-        """Save user data to JSON file"""
+    def save_data(self, then=None):
+        """Compact the storage backend's on-disk data on the background writer, then call then()"""
         try:
-            with open(self.data_file, 'w') as f:
-                json.dump(self.users, f, indent=2)
+            future = self.writer.submit(self.ledger.compact)
+        except queue.Full:
+            messagebox.showerror("Error", "Too many changes are waiting to be saved, try again shortly!")
+            if then is not None:
+                then()
+            return
+        self.root.after(self.POLL_MS, self.wait_for_write, future,
+                        lambda future: self.finish_save(future, then))
+    
+    def finish_save(self, future, then=None):
+        """Report a failed compaction, then call then()"""
+        try:
+            future.result()
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save data: {str(e)}")
+        if then is not None:
+            then()
+    
+    def close_window(self):
+        """Compact the data when the window is closed and quit once that is done
+        
+        Queued writes finish first, as the writer runs jobs in order. Further
+        close requests are ignored meanwhile.
+        """
+        self.root.protocol("WM_DELETE_WINDOW", lambda: None)
+        self.root.title("💳 Online Banking System - Saving…")
+        self.save_data(self.root.destroy)
     
     def create_login_screen(self):
         """Create the login interface"""
@@ -82,10 +302,12 @@ class BankingSystem:
         button_frame = tk.Frame(login_frame, bg="white")
         button_frame.pack(pady=25)
         
-        login_btn = tk.Button(button_frame, text="🚀 Login", font=("Segoe UI", 12, "bold"),
+        # Looked up on each click, so that metrics.instrument() wrapping
+        # self.login after this screen is built still applies
+        self.login_btn = tk.Button(button_frame, text="🚀 Login", font=("Segoe UI", 12, "bold"),
                              bg="#007bff", fg="white", width=12, relief="flat", 
-                             pady=8, command=self.login)
-        login_btn.pack(side='left', padx=15)
+                             pady=8, command=lambda: self.login())
+        self.login_btn.pack(side='left', padx=15)
         
         register_btn = tk.Button(button_frame, text="✨ Register", font=("Segoe UI", 12, "bold"),
                                 bg="#28a745", fg="white", width=12, relief="flat",
@@ -142,11 +364,11 @@ class BankingSystem:
         button_frame = tk.Frame(reg_frame, bg="white")
         button_frame.pack(pady=(25, 30))
         
-        create_btn = tk.Button(button_frame, text="📝 Create Account", 
+        self.create_btn = tk.Button(button_frame, text="📝 Create Account", 
                               font=("Segoe UI", 12, "bold"), bg="#28a745", fg="white", 
                               width=15, command=self.register, cursor="hand2", relief="flat",
                               activebackground="#218838", activeforeground="white")
-        create_btn.pack(side='left', padx=15)
+        self.create_btn.pack(side='left', padx=15)
         
         back_btn = tk.Button(button_frame, text="← Back", font=("Segoe UI", 12, "bold"),
                             bg="#6c757d", fg="white", width=12, 
@@ -155,51 +377,40 @@ class BankingSystem:
         back_btn.pack(side='left', padx=15)
     
     def register(self):
-        """Register a new user"""
+        """Register a new user; the password hashing and the write run on the background writer"""
         username = self.reg_username.get().strip()
         password = self.reg_password.get()
         confirm = self.reg_confirm.get()
         initial = self.initial_deposit.get().strip()
         
-        # Validation
-        if not username or not password:
-            messagebox.showerror("Error", "Username and password are required!")
-            return
-        
-        if username in self.users:
-            messagebox.showerror("Error", "Username already exists!")
+        if password and password != confirm:
+            messagebox.showerror("Error", "Passwords do not match!")
             return
         
-        if password != confirm:
-            messagebox.showerror("Error", "Passwords do not match!")
+        if self.saving:
             return
         
-        if len(password) < 4:
-            messagebox.showerror("Error", "Password must be at least 4 characters!")
+        try:
+            future = self.writer.submit(self.ledger.register, username, password, initial)
+        except queue.Full:
+            messagebox.showerror("Error", "Too many changes are waiting to be saved, try again shortly!")
             return
         
+        self.set_saving(True)
+        self.root.after(self.POLL_MS, self.wait_for_write, future, self.finish_register)
+    
+    def finish_register(self, future):
+        """Return to the login screen once the new account is saved, or show why it was not"""
+        self.set_saving(False)
         try:
-            initial_amount = float(initial)
-            if initial_amount < 100:
-                messagebox.showerror("Error", "Initial deposit must be at least ₹100!")
-                return
-        except ValueError:
-            messagebox.showerror("Error", "Invalid initial deposit amount!")
+            future.result()
+        except LedgerError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to save data: {str(e)}")
             return
         
-        # Create new user
-        self.users[username] = {
-            'password': password,
-            'balance': initial_amount,
-            'transactions': [{
-                'type': 'Initial Deposit',
-                'amount': initial_amount,
-                'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'balance': initial_amount
-            }]
-        }
-        
-        self.save_data()
         messagebox.showinfo("Success", "Account created successfully!")
         self.create_login_screen()
     
@@ -212,10 +423,36 @@ class BankingSystem:
             messagebox.showerror("Error", "Please enter both username and password!")
             return
         
-        if username in self.users and self.users[username]['password'] == password:
+        if self.login_pending:
+            return
+        
+        # Password hashing is slow on purpose; check it off the Tk main loop
+        self.login_pending = True
+        self.login_btn.config(state='disabled', text="⏳ Checking…")
+        future = self.ledger.authenticate_async(username, password)
+        self.root.after(self.POLL_MS, self.finish_login, future, username)
+    
+    def finish_login(self, future, username):
+        """Complete a login once the background password check is done"""
+        if not future.done():
+            self.root.after(self.POLL_MS, self.finish_login, future, username)
+            return
+        
+        self.login_pending = False
+        try:
+            authenticated = future.result()
+        except OSError as e:
+            authenticated = None
+            messagebox.showerror("Error", f"Failed to save data: {str(e)}")
+        
+        if authenticated:
             self.current_user = username
             self.create_main_screen()
-        else:
+            return
+        
+        if self.login_btn.winfo_exists():
+            self.login_btn.config(state='normal', text="🚀 Login")
+        if authenticated is not None:
             messagebox.showerror("Error", "Invalid username or password!")
     
     def create_main_screen(self):
@@ -235,11 +472,11 @@ class BankingSystem:
                                 font=("Segoe UI", 20, "bold"), bg="#2c3e50", fg="white")
         welcome_label.pack(side='left', padx=25, pady=25)
         
-        logout_btn = tk.Button(header_frame, text="🚪 Logout", font=("Segoe UI", 12, "bold"),
+        self.logout_btn = tk.Button(header_frame, text="🚪 Logout", font=("Segoe UI", 12, "bold"),
                               bg="#dc3545", fg="white", command=self.logout,
                               cursor="hand2", relief="flat", padx=20, pady=8,
                               activebackground="#c82333", activeforeground="white")
-        logout_btn.pack(side='right', padx=25, pady=25)
+        self.logout_btn.pack(side='right', padx=25, pady=25)
         
         # Balance display
         balance_frame = tk.Frame(main_frame, bg="white", relief="flat", bd=0)
@@ -248,10 +485,14 @@ class BankingSystem:
         tk.Label(balance_frame, text="💰 Current Balance", font=("Segoe UI", 16, "bold"),
                 bg="white", fg="#495057").pack(pady=(15, 8))
         
-        balance = self.users[self.current_user]['balance']
-        self.balance_label = tk.Label(balance_frame, text=f"₹{balance:.2f}", 
+        self.balance_label = tk.Label(balance_frame, text="⏳", 
                                      font=("Segoe UI", 28, "bold"), bg="white", fg="#28a745")
-        self.balance_label.pack(pady=(0, 15))
+        self.balance_label.pack(pady=(0, 4))
+        
+        # Shows "Saving…" and the writer's queue depth while a write is pending
+        self.saving_label = tk.Label(balance_frame, text="", font=("Segoe UI", 10, "italic"),
+                                    bg="white", fg="#fd7e14")
+        self.saving_label.pack(pady=(0, 11))
         
         # Action buttons
         action_frame = tk.Frame(main_frame, bg="#f8f9fa")
@@ -269,6 +510,12 @@ class BankingSystem:
                                 activebackground="#e8680b", activeforeground="white")
         withdraw_btn.pack(side='left', padx=8)
         
+        transfer_btn = tk.Button(action_frame, text="🔁 Transfer", font=("Segoe UI", 14, "bold"),
+                                bg="#6f42c1", fg="white", width=14, height=2,
+                                command=self.show_transfer, cursor="hand2", relief="flat",
+                                activebackground="#59359a", activeforeground="white")
+        transfer_btn.pack(side='left', padx=8)
+        
         history_btn = tk.Button(action_frame, text="📊 Transaction History", 
                                font=("Segoe UI", 14, "bold"), bg="#007bff", fg="white", 
                                width=18, height=2, command=self.show_history,
@@ -276,6 +523,12 @@ class BankingSystem:
                                activebackground="#0056b3", activeforeground="white")
         history_btn.pack(side='left', padx=8)
         
+        summary_btn = tk.Button(action_frame, text="🧾 Summary", font=("Segoe UI", 14, "bold"),
+                               bg="#17a2b8", fg="white", width=12, height=2,
+                               command=self.show_summary, cursor="hand2", relief="flat",
+                               activebackground="#138496", activeforeground="white")
+        summary_btn.pack(side='left', padx=8)
+        
         # Quick info
         info_frame = tk.Frame(main_frame, bg="white", relief="flat", bd=0)
         info_frame.pack(fill='both', expand=True)
@@ -283,13 +536,51 @@ class BankingSystem:
         tk.Label(info_frame, text="📋 Account Information", font=("Segoe UI", 18, "bold"),
                 bg="white", fg="#495057").pack(pady=(15, 10))
         
-        info_text = f"""🏦 Account Holder: {self.current_user}
-💳 Account Type: Savings Account  
-📈 Total Transactions: {len(self.users[self.current_user]['transactions'])}
-🕒 Last Login: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}"""
+        self.write_buttons = [deposit_btn, withdraw_btn, transfer_btn, self.logout_btn]
+        self.set_saving(self.saving)
         
-        tk.Label(info_frame, text=info_text, font=("Segoe UI", 12), bg="white",
-                justify='left', fg="#6c757d").pack(pady=(10, 20))
+        self.last_login = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.info_label = tk.Label(info_frame, text="⏳ Loading…",
+                                  font=("Segoe UI", 12), bg="white", justify='left',
+                                  fg="#6c757d")
+        self.info_label.pack(pady=(10, 20))
+        self.refresh_account()
+    
+    def read_account(self, username):
+        """Return the balance and summary of an account; runs on the reader or writer thread"""
+        return self.ledger.balance(username), self.ledger.summary(username)
+    
+    def refresh_account(self):
+        """Read the balance and summary on the background reader and show them on the main screen"""
+        username = self.current_user
+        version = self.account_version
+        self.read(lambda future: self.finish_refresh_account(future, username, version),
+                  self.read_account, username)
+    
+    def finish_refresh_account(self, future, username, version):
+        """Show the balance and summary read by refresh_account, unless the screen moved on"""
+        if (username != self.current_user or version != self.account_version
+                or not self.balance_label.winfo_exists()):
+            return
+        try:
+            balance, summary = future.result()
+        except LedgerError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to load data: {str(e)}")
+            return
+        self.update_balance_display(balance, summary)
+    
+    def account_info_text(self, summary):
+        """Build the quick info text from the account's precomputed rollups"""
+        lifetime = summary['lifetime']
+        month = summary['months'][0][1] or {'inflow': 0, 'outflow': 0}
+        return f"""🏦 Account Holder: {self.current_user}
+💳 Account Type: Savings Account  
+📈 Total Transactions: {lifetime['count'] if lifetime else 0}
+📅 This Month: +{format_amount(month['inflow'])} / -{format_amount(month['outflow'])}
+🕒 Last Login: {self.last_login}"""
     
     def show_deposit(self):
         """Show deposit dialog"""
@@ -299,6 +590,57 @@ class BankingSystem:
         """Show withdrawal dialog"""
         self.show_transaction_dialog("Withdraw", self.process_withdraw)
     
+    def show_transfer(self):
+        """Show transfer dialog"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Transfer")
+        dialog.geometry("400x290")
+        dialog.configure(bg="white")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        # Center the dialog
+        dialog.geometry("+%d+%d" % (self.root.winfo_rootx() + 200, 
+                                   self.root.winfo_rooty() + 150))
+        
+        tk.Label(dialog, text="🔁 Transfer Money", font=("Segoe UI", 18, "bold"),
+                bg="white", fg="#495057").pack(pady=(25, 15))
+        
+        tk.Label(dialog, text="Recipient username:", font=("Segoe UI", 12),
+                bg="white", fg="#6c757d").pack()
+        
+        recipient_entry = tk.Entry(dialog, font=("Segoe UI", 14), width=25,
+                                  relief="flat", bd=5, bg="#f8f9fa")
+        recipient_entry.pack(pady=(10, 10))
+        recipient_entry.focus()
+        
+        tk.Label(dialog, text="Enter amount:", font=("Segoe UI", 12),
+                bg="white", fg="#6c757d").pack()
+        
+        amount_entry = tk.Entry(dialog, font=("Segoe UI", 14), width=25,
+                               relief="flat", bd=5, bg="#f8f9fa")
+        amount_entry.pack(pady=(10, 20))
+        
+        submit = lambda: self.process_transfer(recipient_entry.get(), amount_entry.get(), dialog)
+        
+        button_frame = tk.Frame(dialog, bg="white")
+        button_frame.pack(pady=(10, 25))
+        
+        self.confirm_btn = tk.Button(button_frame, text="✅ Confirm", font=("Segoe UI", 12, "bold"),
+                                    bg="#6f42c1", fg="white", width=12, cursor="hand2", relief="flat",
+                                    activebackground="#59359a", activeforeground="white",
+                                    command=submit)
+        self.confirm_btn.pack(side='left', padx=15)
+        
+        cancel_btn = tk.Button(button_frame, text="❌ Cancel", font=("Segoe UI", 12, "bold"),
+                              bg="#6c757d", fg="white", width=12, cursor="hand2", relief="flat",
+                              activebackground="#5a6268", activeforeground="white",
+                              command=dialog.destroy)
+        cancel_btn.pack(side='left', padx=15)
+        
+        # Bind Enter key
+        dialog.bind('<Return>', lambda event: submit())
+    
     def show_transaction_dialog(self, title, callback):
         """Generic transaction dialog"""
         dialog = tk.Toplevel(self.root)
@@ -326,13 +668,13 @@ class BankingSystem:
         button_frame = tk.Frame(dialog, bg="white")
         button_frame.pack(pady=(10, 25))
         
-        confirm_btn = tk.Button(button_frame, text="✅ Confirm", font=("Segoe UI", 12, "bold"),
-                               bg="#28a745" if title == "Deposit" else "#fd7e14", 
-                               fg="white", width=12, cursor="hand2", relief="flat",
-                               activebackground="#218838" if title == "Deposit" else "#e8680b",
-                               activeforeground="white",
-                               command=lambda: callback(amount_entry.get(), dialog))
-        confirm_btn.pack(side='left', padx=15)
+        self.confirm_btn = tk.Button(button_frame, text="✅ Confirm", font=("Segoe UI", 12, "bold"),
+                                    bg="#28a745" if title == "Deposit" else "#fd7e14", 
+                                    fg="white", width=12, cursor="hand2", relief="flat",
+                                    activebackground="#218838" if title == "Deposit" else "#e8680b",
+                                    activeforeground="white",
+                                    command=lambda: callback(amount_entry.get(), dialog))
+        self.confirm_btn.pack(side='left', padx=15)
         
         cancel_btn = tk.Button(button_frame, text="❌ Cancel", font=("Segoe UI", 12, "bold"),
                               bg="#6c757d", fg="white", width=12, cursor="hand2", relief="flat",
@@ -345,124 +687,269 @@ class BankingSystem:
     
     def process_deposit(self, amount_str, dialog):
         """Process deposit transaction"""
-        try:
-            amount = float(amount_str.strip())
-            if amount <= 0:
-                messagebox.showerror("Error", "Amount must be greater than 0!")
-                return
-            
-            # Update balance
-            self.users[self.current_user]['balance'] += amount
-            
-            # Add transaction record
-            transaction = {
-                'type': 'Deposit',
-                'amount': amount,
-                'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'balance': self.users[self.current_user]['balance']
-            }
-            self.users[self.current_user]['transactions'].append(transaction)
-            
-            self.save_data()
-            self.update_balance_display()
-            
-            messagebox.showinfo("Success", f"₹{amount:.2f} deposited successfully!")
-            dialog.destroy()
-            
-        except ValueError:
-            messagebox.showerror("Error", "Please enter a valid amount!")
+        self.commit_transaction(
+            lambda username: self.ledger.deposit(username, amount_str), dialog,
+            lambda transaction: f"{format_amount(transaction['amount'])} deposited successfully!")
     
     def process_withdraw(self, amount_str, dialog):
         """Process withdrawal transaction"""
+        self.commit_transaction(
+            lambda username: self.ledger.withdraw(username, amount_str), dialog,
+            lambda transaction: f"{format_amount(transaction['amount'])} withdrawn successfully!")
+    
+    def process_transfer(self, recipient, amount_str, dialog):
+        """Process transfer to another account"""
+        recipient = recipient.strip()
+        self.commit_transaction(
+            lambda username: self.ledger.transfer(username, recipient, amount_str), dialog,
+            lambda transaction: f"{format_amount(transaction['amount'])} transferred to {recipient} successfully!")
+    
+    def commit_transaction(self, write, dialog, message):
+        """Run write(username) on the background writer and report it once it is saved
+        
+        The write and the balance and summary reads that refresh the main
+        screen after it all run on the writer thread; the Tk loop only polls.
+        """
+        if self.saving:
+            return
+        
+        username = self.current_user
+        def job():
+            return (write(username),) + self.read_account(username)
+        
         try:
-            amount = float(amount_str.strip())
-            if amount <= 0:
-                messagebox.showerror("Error", "Amount must be greater than 0!")
-                return
-            
-            current_balance = self.users[self.current_user]['balance']
-            if amount > current_balance:
-                messagebox.showerror("Error", "Insufficient funds!")
-                return
-            
-            # Update balance
-            self.users[self.current_user]['balance'] -= amount
-            
-            # Add transaction record
-            transaction = {
-                'type': 'Withdrawal',
-                'amount': amount,
-                'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'balance': self.users[self.current_user]['balance']
-            }
-            self.users[self.current_user]['transactions'].append(transaction)
-            
-            self.save_data()
-            self.update_balance_display()
-            
-            messagebox.showinfo("Success", f"₹{amount:.2f} withdrawn successfully!")
+            future = self.writer.submit(job)
+        except queue.Full:
+            messagebox.showerror("Error", "Too many changes are waiting to be saved, try again shortly!")
+            return
+        
+        self.set_saving(True)
+        self.root.after(self.POLL_MS, self.wait_for_write, future,
+                        lambda future: self.finish_transaction(future, dialog, message))
+    
+    def read(self, callback, function, *args):
+        """Run a ledger read on the background reader and call callback(future) from the Tk loop once done
+        
+        A full reader queue is retried on a later poll instead of reported.
+        """
+        try:
+            future = self.reader.submit(function, *args)
+        except queue.Full:
+            self.root.after(self.POLL_MS, self.read, callback, function, *args)
+            return
+        self.root.after(self.POLL_MS, self.wait_for_read, future, callback)
+    
+    def wait_for_read(self, future, callback):
+        """Poll a background read from the Tk loop and call callback(future) once it is done"""
+        if not future.done():
+            self.root.after(self.POLL_MS, self.wait_for_read, future, callback)
+            return
+        callback(future)
+    
+    def wait_for_write(self, future, callback):
+        """Poll a background write from the Tk loop and call callback(future) once it is done"""
+        if not future.done():
+            self.show_queue_depth()
+            self.root.after(self.POLL_MS, self.wait_for_write, future, callback)
+            return
+        callback(future)
+        self.show_queue_depth()
+    
+    def finish_transaction(self, future, dialog, message):
+        """Refresh the main screen after a saved transaction, or show why it failed"""
+        self.set_saving(False)
+        try:
+            transaction, balance, summary = future.result()
+        except LedgerError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to save data: {str(e)}")
+            return
+        
+        if self.current_user is not None:
+            self.account_version += 1
+            self.update_balance_display(balance, summary)
+        
+        messagebox.showinfo("Success", message(transaction))
+        if dialog.winfo_exists():
             dialog.destroy()
-            
-        except ValueError:
-            messagebox.showerror("Error", "Please enter a valid amount!")
+    
+    def set_saving(self, saving):
+        """Disable the buttons that write, and show the saving state, while a write is pending"""
+        self.saving = saving
+        state = 'disabled' if saving else 'normal'
+        for button in self.write_buttons:
+            if button.winfo_exists():
+                button.config(state=state)
+        if self.confirm_btn is not None and self.confirm_btn.winfo_exists():
+            self.confirm_btn.config(state=state, text="⏳ Saving…" if saving else "✅ Confirm")
+        if self.create_btn is not None and self.create_btn.winfo_exists():
+            self.create_btn.config(state=state, text="⏳ Saving…" if saving else "📝 Create Account")
+        self.show_queue_depth()
+    
+    def show_queue_depth(self):
+        """Show "Saving…" with the background writer's queue depth on the main screen"""
+        if self.saving_label is None or not self.saving_label.winfo_exists():
+            return
+        depth = self.writer.queue_depth
+        if depth:
+            self.saving_label.config(text=f"⏳ Saving… ({depth} pending)")
+        else:
+            self.saving_label.config(text="")
     
     def show_history(self):
         """Show transaction history window"""
         history_window = tk.Toplevel(self.root)
         history_window.title("📊 Transaction History")
-        history_window.geometry("750x550")
+        history_window.geometry("800x600")
         history_window.configure(bg="#f8f9fa")
         
         # Title
         tk.Label(history_window, text="📊 Transaction History", 
                 font=("Segoe UI", 20, "bold"), bg="#f8f9fa", fg="#495057").pack(pady=(15, 10))
         
-        # Create treeview for transactions
+        # Filters: date range, type and amount bounds, applied on the storage side
+        filter_frame = tk.Frame(history_window, bg="#f8f9fa")
+        filter_frame.pack(fill='x', padx=25)
+        
+        fields = {}
+        for key, label, width in (('start', "From", 11), ('end', "To", 11),
+                                  ('min_amount', "Min ₹", 8), ('max_amount', "Max ₹", 8)):
+            tk.Label(filter_frame, text=label, font=("Segoe UI", 10), bg="#f8f9fa",
+                    fg="#495057").pack(side='left', padx=(0, 4))
+            fields[key] = tk.Entry(filter_frame, font=("Segoe UI", 10), width=width,
+                                   relief="solid", bd=1)
+            fields[key].pack(side='left', padx=(0, 10))
+        
+        tk.Label(filter_frame, text="Type", font=("Segoe UI", 10), bg="#f8f9fa",
+                fg="#495057").pack(side='left', padx=(0, 4))
+        fields['type'] = ttk.Combobox(filter_frame, values=["All"] + TYPE_NAMES,
+                                      state='readonly', width=13)
+        fields['type'].set("All")
+        fields['type'].pack(side='left', padx=(0, 10))
+        
+        count_label = tk.Label(history_window, font=("Segoe UI", 10), bg="#f8f9fa", fg="#6c757d")
+        
+        # Virtualized treeview: only the visible rows exist, pages load on scroll
         tree_frame = tk.Frame(history_window, bg="#f8f9fa")
-        tree_frame.pack(fill='both', expand=True, padx=25, pady=(10, 15))
+        view = HistoryView(tree_frame, self.ledger, self.current_user, self.read)
+        
+        apply_btn = tk.Button(filter_frame, text="Apply", font=("Segoe UI", 10, "bold"),
+                             bg="#007bff", fg="white", relief="flat", cursor="hand2", padx=10,
+                             command=lambda: self.apply_history_filters(view, fields, count_label))
+        apply_btn.pack(side='left')
+        clear_btn = tk.Button(filter_frame, text="Clear", font=("Segoe UI", 10), bg="#e9ecef",
+                             relief="flat", cursor="hand2", padx=10,
+                             command=lambda: self.clear_history_filters(view, fields, count_label))
+        clear_btn.pack(side='left', padx=(6, 0))
+        
+        count_label.config(text="⏳ Counting…")
+        view.set_filters(None, lambda error: self.show_history_count(error, view, count_label,
+                                                                      "transactions"))
+        count_label.pack(anchor='w', padx=25, pady=(6, 0))
+        tree_frame.pack(fill='both', expand=True, padx=25, pady=(6, 15))
         
-        columns = ('Date', 'Type', 'Amount', 'Balance')
-        tree = ttk.Treeview(tree_frame, columns=columns, show='headings', height=15)
+        # Close button
+        close_btn = tk.Button(history_window, text="❌ Close", font=("Segoe UI", 12, "bold"),
+                             bg="#6c757d", fg="white", width=12, cursor="hand2", relief="flat",
+                             activebackground="#5a6268", activeforeground="white",
+                             command=history_window.destroy)
+        close_btn.pack(pady=(15, 20))
+    
+    def apply_history_filters(self, view, fields, count_label):
+        """Filter the history view by the values entered in the filter fields"""
+        filters = {key: fields[key].get().strip()
+                   for key in ('start', 'end', 'min_amount', 'max_amount')}
+        if fields['type'].get() != "All":
+            filters['types'] = [fields['type'].get()]
+        view.set_filters(filters, lambda error: self.show_history_count(error, view, count_label,
+                                                                         "matching transactions"))
+    
+    def clear_history_filters(self, view, fields, count_label):
+        """Empty the filter fields and show the whole history again"""
+        for key in ('start', 'end', 'min_amount', 'max_amount'):
+            fields[key].delete(0, tk.END)
+        fields['type'].set("All")
+        view.set_filters(None, lambda error: self.show_history_count(error, view, count_label,
+                                                                      "transactions"))
+    
+    def show_history_count(self, error, view, count_label, noun):
+        """Show how many transactions the history view holds, or why counting them failed"""
+        if isinstance(error, LedgerError):
+            messagebox.showerror("Error", str(error))
+        elif error is not None:
+            messagebox.showerror("Error", f"Failed to load transactions: {str(error)}")
+        else:
+            count_label.config(text=f"{view.total} {noun}")
+    
+    def show_summary(self):
+        """Read the account's rollups on the background reader, then show them"""
+        username = self.current_user
+        self.read(lambda future: self.finish_summary(future, username),
+                  self.ledger.summary, username)
+    
+    def finish_summary(self, future, username):
+        """Show lifetime and monthly statistics read from the account's rollups"""
+        if username != self.current_user:
+            return
+        try:
+            summary = future.result()
+        except LedgerError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to load data: {str(e)}")
+            return
+        
+        summary_window = tk.Toplevel(self.root)
+        summary_window.title("🧾 Account Summary")
+        summary_window.geometry("650x480")
+        summary_window.configure(bg="#f8f9fa")
+        
+        tk.Label(summary_window, text="🧾 Account Summary", 
+                font=("Segoe UI", 20, "bold"), bg="#f8f9fa", fg="#495057").pack(pady=(15, 10))
         
-        # Define headings
+        lifetime = summary['lifetime']
+        if lifetime:
+            lifetime_text = f"""💵 Money In: {format_amount(lifetime['inflow'])}
+💸 Money Out: {format_amount(lifetime['outflow'])}
+📊 Average Balance: {format_amount(average_balance(lifetime))}
+📉 Lowest / Highest Balance: {format_amount(lifetime['min_balance'])} / {format_amount(lifetime['max_balance'])}
+🔻 Largest Withdrawal: {format_amount(lifetime['largest_withdrawal'])}"""
+        else:
+            lifetime_text = "No transactions yet"
+        tk.Label(summary_window, text=lifetime_text, font=("Segoe UI", 12), bg="#f8f9fa",
+                justify='left', fg="#6c757d").pack(pady=(5, 10))
+        
+        # One row per recent month, newest first
+        tree_frame = tk.Frame(summary_window, bg="#f8f9fa")
+        tree_frame.pack(fill='both', expand=True, padx=25, pady=(5, 10))
+        columns = ('Month', 'Transactions', 'In', 'Out', 'Closing Balance')
+        tree = ttk.Treeview(tree_frame, columns=columns, show='headings', height=6)
         for col in columns:
             tree.heading(col, text=col)
-            if col == 'Date':
-                tree.column(col, width=150)
-            elif col == 'Type':
-                tree.column(col, width=120)
+            tree.column(col, width=110, anchor='center')
+        for month, rollup in summary['months']:
+            if rollup:
+                tree.insert('', 'end', values=(month, rollup['count'],
+                                               format_amount(rollup['inflow']),
+                                               format_amount(rollup['outflow']),
+                                               format_amount(rollup['closing_balance'])))
             else:
-                tree.column(col, width=100)
-        
-        # scrollbar
-        scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
-        tree.configure(yscroll=scrollbar.set)
-        
-        # Pack treeview and scrollbar
-        tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
-        
-        # Insert transaction data
-        transactions = self.users[self.current_user]['transactions']
-        for transaction in reversed(transactions):  # Show most recent first
-            tree.insert('', 'end', values=(
-                transaction['date'],
-                transaction['type'],
-                f"₹{transaction['amount']:.2f}",
-                f"₹{transaction['balance']:.2f}"
-            ))
+                tree.insert('', 'end', values=(month, 0, format_amount(0), format_amount(0), '-'))
+        tree.pack(fill='both', expand=True)
         
-        # Close button
-        close_btn = tk.Button(history_window, text="❌ Close", font=("Segoe UI", 12, "bold"),
+        close_btn = tk.Button(summary_window, text="❌ Close", font=("Segoe UI", 12, "bold"),
                              bg="#6c757d", fg="white", width=12, cursor="hand2", relief="flat",
                              activebackground="#5a6268", activeforeground="white",
-                             command=history_window.destroy)
-        close_btn.pack(pady=(15, 20))
+                             command=summary_window.destroy)
+        close_btn.pack(pady=(10, 20))
     
-    def update_balance_display(self):
-        """Update the balance display on main screen"""
-        balance = self.users[self.current_user]['balance']
-        self.balance_label.config(text=f"₹{balance:.2f}")
+    def update_balance_display(self, balance, summary):
+        """Update the balance and quick info on main screen"""
+        self.balance_label.config(text=format_amount(balance))
+        self.info_label.config(text=self.account_info_text(summary))
     
     def logout(self):
         """Logout current user"""
@@ -475,10 +962,134 @@ class BankingSystem:
             widget.destroy()
     
     def run(self):
-        """Start the banking system"""
+        """Start the banking system, then finish any writes still queued and close the ledger"""
         self.root.mainloop()
+        self.writer.close()
+        self.reader.close()
+        self.ledger.close()
+
+def run_bulk(ledger, args):
+    """Run a headless --import or --export against the ledger and return the exit status"""
+    if args.import_file:
+        fmt = args.format or guess_format(args.import_file)
+        def report(line, message):
+            print(f"{args.import_file}:{line}: {message}", file=sys.stderr)
+        with open_stream(args.import_file, 'r') as stream:
+            applied, rejected = import_transactions(ledger, stream, fmt, on_error=report)
+        print(f"Imported {applied} transactions, rejected {rejected}", file=sys.stderr)
+        return 1 if rejected else 0
+    fmt = args.format or guess_format(args.export_file)
+    try:
+        with open_stream(args.export_file, 'w') as stream:
+            count = export_statements(ledger, stream, fmt, args.account,
+                                      args.date_from, args.date_to)
+    except LedgerError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"Exported {count} transactions", file=sys.stderr)
+    return 0
+
+def open_stream(path, mode):
+    """Open a text file for CSV/JSON Lines I/O, with '-' meaning stdin or stdout"""
+    if path == '-':
+        return nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    return open(path, mode, newline='', encoding='utf-8')
+
+def local_ledger(args):
+    """Create a Ledger on the storage backend chosen on the command line"""
+    return Ledger(storage_from_args(args))
 
 # Run the banking system
 if __name__ == "__main__":
-    banking_system = BankingSystem()
-    banking_system.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Online Banking System")
+    add_storage_arguments(parser)
+    parser.add_argument("--metrics", action="store_true",
+                        help="record operation latencies and counters; print them on exit and on SIGUSR1")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve metrics at http://127.0.0.1:PORT/metrics (implies --metrics)")
+    parser.add_argument("--server", metavar="HOST:PORT",
+                        help="use a running banking server instead of local storage")
+    parser.add_argument("--rebuild-stats", action="store_true",
+                        help="recompute every account's statistics from its transactions and exit")
+    parser.add_argument("--audit", action="store_true",
+                        help="check every account's history since its last checkpoint and exit")
+    parser.add_argument("--full-audit", action="store_true",
+                        help="check every account's whole history and all checkpoints and exit")
+    parser.add_argument("--balance-as-of", metavar="DATE",
+                        help="print the balances of the --account accounts at the end of DATE and exit")
+    bulk = parser.add_argument_group("bulk import/export (runs headless and exits)")
+    bulk.add_argument("--import", dest="import_file", metavar="FILE",
+                      help="apply the deposits and withdrawals in FILE ('-' for stdin)")
+    bulk.add_argument("--export", dest="export_file", metavar="FILE",
+                      help="write account statements to FILE ('-' for stdout)")
+    bulk.add_argument("--format", choices=FORMATS,
+                      help="csv or jsonl (default: from the file extension, else csv)")
+    bulk.add_argument("--account", action="append",
+                      help="export only this account, or the account for --balance-as-of "
+                           "(repeatable; default: all)")
+    bulk.add_argument("--from", dest="date_from", metavar="DATE",
+                      help="export transactions from DATE (YYYY-MM[-DD]) on")
+    bulk.add_argument("--to", dest="date_to", metavar="DATE",
+                      help="export transactions up to DATE (YYYY-MM[-DD]) inclusive")
+    args = parser.parse_args()
+    
+    if args.import_file or args.export_file:
+        if args.import_file and args.export_file:
+            parser.error("--import and --export cannot be combined")
+        ledger = local_ledger(args)
+        ledger.load()
+        status = run_bulk(ledger, args)
+        ledger.close()
+        parser.exit(status)
+    
+    if args.rebuild_stats:
+        ledger = local_ledger(args)
+        ledger.load()
+        print(f"Rebuilt statistics of {ledger.rebuild_stats()} accounts")
+        ledger.compact()
+        ledger.close()
+        parser.exit()
+    
+    if args.audit or args.full_audit:
+        ledger = local_ledger(args)
+        ledger.load()
+        checked, failures = ledger.audit_all(full=args.full_audit)
+        ledger.close()
+        for username, problems in sorted(failures.items()):
+            for problem in problems:
+                print(f"{username}: {problem}", file=sys.stderr)
+        print(f"Audited {checked} accounts, {len(failures)} with problems")
+        parser.exit(1 if failures else 0)
+    
+    if args.balance_as_of:
+        ledger = local_ledger(args)
+        ledger.load()
+        status = 0
+        for username in args.account or ledger.usernames():
+            try:
+                balance = ledger.balance_as_of(username, args.balance_as_of)
+            except LedgerError as e:
+                print(f"{username}: {e}", file=sys.stderr)
+                status = 1
+            else:
+                print(f"{username}\t{format_rupees(balance)}")
+        ledger.close()
+        parser.exit(status)
+    
+    if args.server:
+        ledger = LedgerClient(*parse_address(args.server))
+    else:
+        ledger = local_ledger(args)
+    record_metrics = args.metrics or args.metrics_port is not None
+    if record_metrics:
+        metrics.enable()
+        metrics.instrument_ledger(ledger)
+        metrics.dump_on_signal()
+        if args.metrics_port is not None:
+            metrics.serve(port=args.metrics_port)
+    banking_system = BankingSystem(ledger)
+    if record_metrics:
+        metrics.instrument(banking_system, metrics.UI_OPERATIONS, 'ui')
+    banking_system.run()
+    if record_metrics:
+        sys.stderr.write(metrics.REGISTRY.render())
\ No newline at end of file
@@ -0,0 +1,412 @@
+"""Load-generation benchmarks for the ledger
+
+Each benchmark builds a throwaway bank in a temporary directory, runs its
+workload headless and prints one JSON object with the results:
+
+    python bench.py transfer --accounts 1000 --threads 8 --transfers 20000
+    python bench.py suite --users 10000 --transactions 100 --operations 1000
+
+The suite generates a synthetic bank of the given size, then times each
+operation the app performs in a fresh process, so that startup time and peak
+RSS belong to that operation alone. Save the JSON and pass it back with
+--baseline to fail on regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from multiprocessing import get_context
+
+from columns import format_timestamp
+from ledger import Ledger, LedgerError
+from money import PAISE_PER_RUPEE
+from passwords import DEFAULT_ITERATIONS, PasswordHasher
+from storage import (add_group_commit_arguments, add_storage_arguments, open_storage,
+                     storage_options_from_args)
+
+
+INITIAL_BALANCE = 10000  # rupees
+# Keep account setup fast; the suite hashes at the app's cost unless told otherwise
+HASH_ITERATIONS = 1000
+PASSWORD = "secret"
+SUITE_OPERATIONS = ('startup', 'register', 'login', 'deposit', 'withdraw', 'history', 'save')
+# Suite operations that pay for a full password hash per call
+HASHED_OPERATIONS = ('register', 'login')
+# Timed calls of a hashed operation at most, as each one takes a tenth of a second or so
+HASHED_OPERATION_CALLS = 100
+# Transactions per storage write while generating a bank: a write holds as many
+# accounts as fit, and an account with a longer history takes several writes
+BUILD_CHUNK_ROWS = 100000
+# Rows the history window fetches when it opens (HistoryView.PAGE_SIZE)
+HISTORY_PAGE = 100
+# Synthetic histories end here and go back one hour per transaction
+HISTORY_END = 1767225600  # 2026-01-01 00:00:00 UTC
+
+
+def make_ledger(backend, directory, hash_iterations=HASH_ITERATIONS, **options):
+    """Open a ledger on a fresh data file of the given backend inside directory
+
+    options, such as commit_delay, go to the storage backend.
+    """
+    ledger = Ledger(open_storage(backend, os.path.join(directory, f"bench_{backend}.data"),
+                                 **options),
+                    PasswordHasher(hash_iterations))
+    ledger.load()
+    return ledger
+
+
+def create_accounts(ledger, count, balance=INITIAL_BALANCE):
+    """Register count accounts in one batch and return their usernames"""
+    usernames = [f"user{i:07d}" for i in range(count)]
+    ledger.apply_batch([{'op': 'register', 'username': name, 'password': 'secret',
+                         'amount': balance} for name in usernames])
+    return usernames
+
+
+def bench_transfer(backend="json", accounts=1000, threads=8, transfers=20000, seed=0,
+                   commit_delay=0.0, commit_batch=1000, storage_options=None):
+    """Run random-pair transfers from several threads and report their throughput
+
+    Afterwards the balances of all accounts must still add up to what was
+    deposited, which would not hold if a transfer were applied half-way. The
+    commit counters show how many transfers shared each group commit.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        ledger = make_ledger(backend, directory, commit_delay=commit_delay,
+                             commit_batch=commit_batch, **(storage_options or {}))
+        committers = getattr(ledger.storage, 'committers', None) or [ledger.storage.committer]
+        flushes_before = sum(committer.flushes for committer in committers)
+        committed_before = sum(committer.committed for committer in committers)
+        usernames = create_accounts(ledger, accounts)
+        per_thread = transfers // threads
+        rejected = [0] * threads
+
+        def worker(index):
+            rng = random.Random(seed + index)
+            for _ in range(per_thread):
+                sender, recipient = rng.sample(usernames, 2)
+                try:
+                    ledger.transfer(sender, recipient, rng.randint(1, 100))
+                except LedgerError:
+                    rejected[index] += 1
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        flushes = sum(committer.flushes for committer in committers) - flushes_before
+        committed = sum(committer.committed for committer in committers) - committed_before
+
+        total = sum(ledger.balance(name) for name in usernames)
+        ledger.close()
+
+    completed = per_thread * threads
+    return {
+        'benchmark': 'transfer',
+        'storage': backend,
+        'accounts': accounts,
+        'threads': threads,
+        'transfers': completed,
+        'rejected': sum(rejected),
+        'seconds': round(elapsed, 4),
+        'transfers_per_second': round(completed / elapsed, 1),
+        'commit_delay_ms': commit_delay * 1000,
+        'commits': flushes,
+        'writes_per_commit': round(committed / flushes, 2) if flushes else 0,
+        'balance_conserved': total == accounts * INITIAL_BALANCE * PAISE_PER_RUPEE,
+    }
+
+
+def synthetic_history(rng, count, balance=INITIAL_BALANCE * PAISE_PER_RUPEE):
+    """Yield count transactions, oldest first, that start with an initial deposit
+
+    Deposits and withdrawals alternate at random and never overdraw.
+    """
+    start = HISTORY_END - 3600 * count
+    yield {'type': 'Initial Deposit', 'amount': balance,
+           'date': format_timestamp(start), 'balance': balance}
+    for i in range(1, count):
+        amount = rng.randint(1, 5000) * PAISE_PER_RUPEE // 100
+        if amount <= balance and rng.random() < 0.5:
+            kind, balance = 'Withdrawal', balance - amount
+        else:
+            kind, balance = 'Deposit', balance + amount
+        yield {'type': kind, 'amount': amount,
+               'date': format_timestamp(start + 3600 * i), 'balance': balance}
+
+
+def build_bank(backend, path, users, transactions, seed=0, hash_iterations=HASH_ITERATIONS,
+               storage_options=None):
+    """Write a bank of users accounts with transactions each to a new data file
+
+    Every account shares one password hash, since hashing millions of
+    passwords would dwarf everything else. Returns the usernames.
+    """
+    rng = random.Random(seed)
+    hashed = PasswordHasher(hash_iterations).hash(PASSWORD)
+    usernames = [f"user{i:07d}" for i in range(users)]
+    storage = open_storage(backend, path, **(storage_options or {}))
+    storage.load()
+    per_write = max(1, BUILD_CHUNK_ROWS // max(1, transactions))
+    for first in range(0, users, per_write):
+        changes = []
+        histories = []
+        for username in usernames[first:first + per_write]:
+            history = synthetic_history(rng, transactions)
+            head = list(islice(history, BUILD_CHUNK_ROWS))
+            changes.append(('register', username, {'password': hashed,
+                                                   'balance': head[-1]['balance'],
+                                                   'transactions': head}))
+            histories.append((username, history))
+        storage.write_batch(changes)
+        for username, history in histories:
+            while True:
+                rest = [('transaction', username, transaction)
+                        for transaction in islice(history, BUILD_CHUNK_ROWS)]
+                if not rest:
+                    break
+                storage.write_batch(rest)
+    storage.compact()
+    storage.close()
+    return usernames
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed):
+    """Throughput and latency percentiles (in milliseconds) of one operation's samples"""
+    latencies = sorted(latencies)
+    return {
+        'operations': len(latencies),
+        'seconds': round(elapsed, 4),
+        'ops_per_second': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB"""
+    # On Linux ru_maxrss survives exec, so a child started by a big parent
+    # would report the parent's peak; VmHWM starts afresh with the new image
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_operation(operation, backend, path, users, count, seed=0,
+                  hash_iterations=DEFAULT_ITERATIONS, storage_options=None):
+    """Open the bank at path, run count timed calls of one suite operation and summarize them
+
+    Runs in its own process so that startup time and peak RSS are this
+    operation's alone. 'startup' times opening the bank and the first balance
+    read; 'save' times a compaction after a deposit; 'history' times what the
+    history window does when it opens.
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    ledger = Ledger(open_storage(backend, path, **(storage_options or {})),
+                    PasswordHasher(hash_iterations))
+    ledger.load()
+    ledger.balance(rng.choice(users))
+    startup = time.perf_counter() - start
+
+    if operation == 'startup':
+        call = None
+    elif operation == 'register':
+        def call(i):
+            ledger.register(f"new{seed:04d}{i:07d}", PASSWORD, INITIAL_BALANCE)
+    elif operation == 'login':
+        def call(i):
+            # A cleared cache makes every login pay for a full hash check
+            ledger.passwords.cache.clear()
+            if not ledger.authenticate(rng.choice(users), PASSWORD):
+                raise AssertionError("Synthetic login failed")
+    elif operation == 'deposit':
+        def call(i):
+            ledger.deposit(rng.choice(users), rng.randint(1, 1000))
+    elif operation == 'withdraw':
+        def call(i):
+            try:
+                ledger.withdraw(rng.choice(users), rng.randint(1, 100))
+            except LedgerError:
+                pass
+    elif operation == 'history':
+        def call(i):
+            username = rng.choice(users)
+            ledger.transaction_count(username)
+            ledger.history(username, 0, HISTORY_PAGE, 'date', True)
+    elif operation == 'save':
+        def call(i):
+            ledger.deposit(rng.choice(users), 1)
+            ledger.compact()
+    else:
+        raise ValueError(f"Unknown operation: {operation}")
+
+    latencies = []
+    began = time.perf_counter()
+    if call is None:
+        latencies.append(startup)
+    else:
+        for i in range(count):
+            before = time.perf_counter()
+            call(i)
+            latencies.append(time.perf_counter() - before)
+    elapsed = startup if call is None else time.perf_counter() - began
+    ledger.close()
+    result = summarize(latencies, elapsed)
+    result['startup_seconds'] = round(startup, 4)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def bench_suite(backend="json", users=1000, transactions=100, operations=1000,
+                selected=SUITE_OPERATIONS, seed=0, hash_iterations=DEFAULT_ITERATIONS,
+                storage_options=None):
+    """Generate a bank and benchmark each selected operation in a fresh process
+
+    Passwords are hashed at hash_iterations, by default the app's own cost, so
+    'register' and 'login' report real latencies; they run at most
+    HASHED_OPERATION_CALLS times. 'save' compacts the whole bank each time, so
+    it runs at most 10 times.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"bench_{backend}.data")
+        start = time.perf_counter()
+        usernames = build_bank(backend, path, users, transactions, seed, hash_iterations,
+                               storage_options)
+        build = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(directory, name))
+                   for name in os.listdir(directory))
+        results = {}
+        for index, operation in enumerate(selected):
+            count = operations
+            if operation == 'save':
+                count = min(operations, 10)
+            elif operation in HASHED_OPERATIONS:
+                count = min(operations, HASHED_OPERATION_CALLS)
+            with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+                results[operation] = pool.submit(
+                    run_operation, operation, backend, path, usernames, count,
+                    seed + index, hash_iterations, storage_options).result()
+    return {
+        'benchmark': 'suite',
+        'storage': backend,
+        'storage_options': storage_options or {},
+        'users': users,
+        'transactions_per_user': transactions,
+        'hash_iterations': hash_iterations,
+        'build_seconds': round(build, 4),
+        'data_bytes': size,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def regressions(result, baseline, tolerance=0.2):
+    """List the suite metrics that got worse than baseline by more than tolerance
+
+    Operations that hash passwords are only compared when both runs hashed at
+    the same cost.
+    """
+    found = []
+    same_cost = result.get('hash_iterations') == baseline.get('hash_iterations')
+    for operation, metrics in result.get('results', {}).items():
+        before = baseline.get('results', {}).get(operation)
+        if before is None or (operation in HASHED_OPERATIONS and not same_cost):
+            continue
+        for metric, higher_is_better in (('ops_per_second', True), ('p50_ms', False),
+                                         ('p99_ms', False), ('startup_seconds', False),
+                                         ('peak_rss_mb', False)):
+            old, new = before.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (old - new) / old if higher_is_better else (new - old) / old
+            if change > tolerance:
+                found.append(f"{operation} {metric}: {old} -> {new}")
+    return found
+
+
+def main(argv=None):
+    """Parse the command line, run one benchmark and print its JSON result"""
+    parser = argparse.ArgumentParser(description="Ledger benchmarks")
+    add_storage_arguments(parser, data_file=False, group_commit=False)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    transfer = subparsers.add_parser("transfer", help="concurrent random-pair transfers")
+    transfer.add_argument("--accounts", type=int, default=1000)
+    transfer.add_argument("--threads", type=int, default=8)
+    transfer.add_argument("--transfers", type=int, default=20000)
+    transfer.add_argument("--seed", type=int, default=0)
+    add_group_commit_arguments(transfer)
+
+    suite = subparsers.add_parser("suite", help="per-operation latency, startup and memory "
+                                                "on a synthetic bank")
+    suite.add_argument("--users", type=int, default=1000)
+    suite.add_argument("--transactions", type=int, default=100,
+                       help="transactions per user, including the initial deposit")
+    suite.add_argument("--operations", type=int, default=1000,
+                       help="timed calls per operation")
+    suite.add_argument("--only", action="append", choices=SUITE_OPERATIONS,
+                       help="run only this operation (repeatable; default: all)")
+    suite.add_argument("--hash-iterations", type=int, default=DEFAULT_ITERATIONS,
+                       help=f"password hashing cost (default: the app's {DEFAULT_ITERATIONS}; "
+                            f"a cheaper cost such as {HASH_ITERATIONS} makes quick runs, "
+                            f"but register and login then no longer match the app)")
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--output", help="also write the JSON result to this file")
+    suite.add_argument("--baseline", help="earlier JSON result to compare against; "
+                                          "exits with status 1 on regressions")
+    suite.add_argument("--tolerance", type=float, default=0.2,
+                       help="allowed relative slowdown against the baseline (default: 0.2)")
+
+    args = parser.parse_args(argv)
+    options = storage_options_from_args(args)
+    if args.benchmark == "transfer":
+        result = bench_transfer(args.storage, args.accounts, args.threads,
+                                args.transfers, args.seed, options.pop('commit_delay'),
+                                options.pop('commit_batch'), options)
+    else:
+        result = bench_suite(args.storage, args.users, args.transactions, args.operations,
+                             args.only or SUITE_OPERATIONS, args.seed, args.hash_iterations,
+                             options)
+        if args.baseline:
+            with open(args.baseline) as f:
+                result['regressions'] = regressions(result, json.load(f), args.tolerance)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent=2)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    if result.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Streaming bulk import of deposits and withdrawals, and statement export
+
+Imports read CSV or JSON Lines rows and hand them to Ledger.apply_batch in
+fixed-size chunks, so memory stays bounded however long the file is and every
+row passes the same checks as a deposit or withdrawal made in the app:
+
+    op,username,amount
+    deposit,alice,2500.00
+    withdraw,bob,120
+
+    {"op": "deposit", "username": "alice", "amount": "2500.00"}
+
+Exports page through each account's history and write statement rows as they
+are read. Amounts are written as plain rupees, the same form imports accept.
+"""
+import csv
+import json
+from itertools import islice
+
+from ledger import LedgerError
+from money import format_rupees
+
+
+FORMATS = ('csv', 'jsonl')
+# A tuple: its membership test compares, so unhashable JSON values are simply not in it
+IMPORT_OPS = ('deposit', 'withdraw')
+STATEMENT_FIELDS = ('username', 'date', 'type', 'amount', 'balance')
+# Each batch is one log record and one flush, and each account's rows in it
+# are applied together, so the per-account work shrinks as batches grow;
+# 20000 rows still keep memory small
+BATCH_SIZE = 20000
+EXPORT_PAGE_SIZE = 1000
+
+
+def guess_format(path, default='csv'):
+    """Pick a format from a file name's extension"""
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else default
+
+
+def read_rows(stream, fmt='csv'):
+    """Yield (line number, row) pairs from a CSV stream with a header row or a JSON Lines stream
+
+    Rows that cannot be parsed are yielded as None. CSV rows become dicts keyed by
+    the header like csv.DictReader's, without its per-row overhead.
+    """
+    if fmt == 'csv':
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        if header is None:
+            return
+        for row in reader:
+            if row:
+                yield reader.line_num, dict(zip(header, row))
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def import_transactions(ledger, stream, fmt='csv', batch_size=BATCH_SIZE, on_error=None):
+    """Apply the deposits and withdrawals of a stream and return (applied, rejected)
+
+    Rows are committed batch_size at a time, each batch with a single storage
+    write. on_error(line number, message) is called for every rejected row.
+    """
+    applied = rejected = 0
+    rows = read_rows(stream, fmt)
+    # The imported rows are compacted once, when the import is done
+    with ledger.deferred_compaction():
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                break
+            lines = []
+            operations = []
+            errors = []
+            for number, row in chunk:
+                if isinstance(row, dict) and isinstance(row.get('username'), str) \
+                        and row.get('op') in IMPORT_OPS:
+                    # apply_batch only reads op, username and amount of these rows
+                    lines.append(number)
+                    operations.append(row)
+                elif not isinstance(row, dict) or not isinstance(row.get('username'), str):
+                    errors.append((number, "Malformed row"))
+                else:
+                    errors.append((number, f"Unknown operation: {row.get('op')}"))
+            if operations:
+                for number, result in zip(lines, ledger.apply_batch(operations)):
+                    if isinstance(result, LedgerError):
+                        errors.append((number, str(result)))
+            applied += len(chunk) - len(errors)
+            rejected += len(errors)
+            if on_error is not None:
+                for number, message in sorted(errors):
+                    on_error(number, message)
+    return applied, rejected
+
+
+def statement(ledger, username, start=None, end=None):
+    """Yield an account's transactions dated from start to end inclusive, oldest first
+
+    start and end are dates such as '2025-07' or '2025-07-15'. Raises
+    LedgerError for an unknown account or a malformed date.
+    """
+    ledger.balance(username)
+    filters = {'start': start, 'end': end}
+    offset = 0
+    while True:
+        page = ledger.history(username, offset, EXPORT_PAGE_SIZE, filters=filters)
+        yield from page
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        offset += len(page)
+
+
+def export_statements(ledger, stream, fmt='csv', usernames=None, start=None, end=None):
+    """Write the statements of some accounts (default: all) to a stream and return the row count"""
+    if usernames is None:
+        usernames = ledger.usernames()
+    writer = csv.writer(stream) if fmt == 'csv' else None
+    if writer is not None:
+        writer.writerow(STATEMENT_FIELDS)
+    count = 0
+    for username in usernames:
+        for transaction in statement(ledger, username, start, end):
+            row = (username, transaction['date'], transaction['type'],
+                   format_rupees(transaction['amount']), format_rupees(transaction['balance']))
+            if writer is not None:
+                writer.writerow(row)
+            else:
+                stream.write(json.dumps(dict(zip(STATEMENT_FIELDS, row))) + '\n')
+            count += 1
+    return count
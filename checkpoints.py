@@ -0,0 +1,87 @@
+"""Per-account balance checkpoints for cheap integrity audits
+
+After every CHECKPOINT_EVERY transactions an account records a checkpoint
+[position, balance, checksum]: the number of transactions it covers, the
+balance after the last of them and a SHA-256 chained over the previous
+checkpoint's checksum and this segment's transactions. An audit then only
+replays the transactions after the last checkpoint, checking that each running
+balance follows from the one before; a full audit replays everything and also
+recomputes every checksum, which exposes edits to older history.
+"""
+import hashlib
+
+from stats import INFLOW_TYPES
+
+
+CHECKPOINT_EVERY = 1000
+# Checksum the first checkpoint chains from
+GENESIS = ''
+
+
+def encode(transaction):
+    """Canonical bytes of a transaction for checksums"""
+    return (f"{transaction['type']}|{transaction['amount']}|{transaction['date']}|"
+            f"{transaction['balance']}\n").encode('utf-8')
+
+
+def chain(checksum, transactions):
+    """Extend a checkpoint checksum over the transactions that follow it"""
+    digest = hashlib.sha256(checksum.encode('ascii'))
+    for transaction in transactions:
+        digest.update(encode(transaction))
+    return digest.hexdigest()
+
+
+def next_balance(balance, transaction):
+    """Balance after applying a transaction to the balance before it"""
+    if transaction['type'] in INFLOW_TYPES:
+        return balance + transaction['amount']
+    return balance - transaction['amount']
+
+
+def extend_checkpoints(checkpoints, transactions, every=CHECKPOINT_EVERY):
+    """Append the checkpoints that have become due to an account's list in place
+
+    transactions is the account's whole history in recorded order (a list or
+    TransactionColumns); only segments after the last checkpoint are read.
+    """
+    position, checksum = (checkpoints[-1][0], checkpoints[-1][2]) if checkpoints else (0, GENESIS)
+    while len(transactions) - position >= every:
+        segment = transactions[position:position + every]
+        checksum = chain(checksum, segment)
+        position += every
+        checkpoints.append([position, segment[-1]['balance'], checksum])
+    return checkpoints
+
+
+def verify(transactions, balance, base=None, checkpoints=()):
+    """Return the problems found in a stretch of an account's history; empty if it checks out
+
+    transactions are the ones recorded after checkpoint base (None: all of
+    them, starting from a zero balance), and checkpoints those falling inside
+    that stretch, in order, whose balance and checksum are recomputed. balance
+    is the account's current balance.
+    """
+    problems = []
+    position, running, checksum = base if base is not None else (0, 0, GENESIS)
+    pending = list(checkpoints)
+    digest = hashlib.sha256(checksum.encode('ascii'))
+    for transaction in transactions:
+        expected = next_balance(running, transaction)
+        if transaction['balance'] != expected:
+            problems.append(f"Transaction {position + 1} ({transaction['date']}) records a "
+                            f"balance of {transaction['balance']}, expected {expected}")
+        running = transaction['balance']
+        digest.update(encode(transaction))
+        position += 1
+        if pending and pending[0][0] == position:
+            checkpoint = pending.pop(0)
+            if checkpoint[1] != running or checkpoint[2] != digest.hexdigest():
+                problems.append(f"Checkpoint at transaction {position} does not match "
+                                f"the history before it")
+            digest = hashlib.sha256(checkpoint[2].encode('ascii'))
+    for checkpoint in pending:
+        problems.append(f"Checkpoint at transaction {checkpoint[0]} is past the end of the history")
+    if running != balance:
+        problems.append(f"Balance is {balance}, but the history adds up to {running}")
+    return problems
@@ -0,0 +1,190 @@
+"""Compact columnar storage for an account's transaction history
+
+A transaction kept as a dict with four string keys and a date string costs
+several hundred bytes. TransactionColumns keeps the same data in parallel
+arrays instead: amount and running balance as int64 paise, the date as int64
+seconds and the type as a one-byte code, about 25 bytes per transaction.
+Indexing still returns ordinary transaction dicts, so callers are unchanged.
+"""
+import calendar
+import threading
+import time
+from array import array
+
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+TYPE_NAMES = ['Initial Deposit', 'Deposit', 'Withdrawal', 'Transfer Out', 'Transfer In']
+_TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+_types_lock = threading.Lock()
+_PERIOD_FORMATS = {4: '%Y', 7: '%Y-%m', 10: '%Y-%m-%d', 19: DATE_FORMAT}
+# Transactions written together share a date, so the last conversion is reused
+_last_parsed = (None, None)
+
+
+def type_code(name):
+    """Return the small-int code of a transaction type, registering new types on first use"""
+    code = _TYPE_CODES.get(name)
+    if code is None:
+        with _types_lock:
+            code = _TYPE_CODES.get(name)
+            if code is None:
+                if len(TYPE_NAMES) >= 256:
+                    raise ValueError(f"Too many transaction types to encode: {name}")
+                code = _TYPE_CODES[name] = len(TYPE_NAMES)
+                TYPE_NAMES.append(name)
+    return code
+
+
+def parse_timestamp(date):
+    """Convert a 'YYYY-MM-DD HH:MM:SS' date to seconds, reading the wall-clock time as UTC
+
+    Dates are stored as local wall-clock time, so treating them as UTC gives an
+    exact round trip through format_timestamp with no DST ambiguity.
+    """
+    global _last_parsed
+    cached = _last_parsed
+    if cached[0] == date:
+        return cached[1]
+    timestamp = None
+    if len(date) == 19 and date[4] == '-' and date[10] == ' ':
+        try:
+            timestamp = calendar.timegm((int(date[0:4]), int(date[5:7]), int(date[8:10]),
+                                         int(date[11:13]), int(date[14:16]), int(date[17:19])))
+        except ValueError:
+            pass
+    if timestamp is None:
+        timestamp = calendar.timegm(time.strptime(date, DATE_FORMAT))
+    _last_parsed = (date, timestamp)
+    return timestamp
+
+
+def period_bounds(text):
+    """Return the [first second, first second after) range of a 'YYYY', 'YYYY-MM', 'YYYY-MM-DD' or full date
+
+    Raises ValueError for anything else.
+    """
+    text = text.strip()
+    fmt = _PERIOD_FORMATS.get(len(text))
+    if fmt is None:
+        raise ValueError(f"Invalid date: {text}")
+    parsed = time.strptime(text, fmt)
+    low = calendar.timegm(parsed)
+    if fmt == '%Y':
+        return low, calendar.timegm((parsed.tm_year + 1, 1, 1, 0, 0, 0))
+    if fmt == '%Y-%m':
+        year, month = divmod(parsed.tm_year * 12 + parsed.tm_mon, 12)
+        return low, calendar.timegm((year, month + 1, 1, 0, 0, 0))
+    return low, low + (86400 if fmt == '%Y-%m-%d' else 1)
+
+
+def format_timestamp(timestamp):
+    """Convert seconds from parse_timestamp back to a 'YYYY-MM-DD HH:MM:SS' date"""
+    return time.strftime(DATE_FORMAT, time.gmtime(timestamp))
+
+
+class TransactionColumns:
+    """List-like transaction history stored as parallel typed arrays"""
+
+    __slots__ = ('amounts', 'balances', 'timestamps', 'types')
+
+    def __init__(self, transactions=()):
+        self.amounts = array('q')
+        self.balances = array('q')
+        self.timestamps = array('q')
+        self.types = array('B')
+        self.extend(transactions)
+
+    def append(self, transaction):
+        """Add a transaction dict to the end of the history
+
+        Values that do not fit the arrays raise before any column has grown, so
+        the columns always stay the same length.
+        """
+        code = type_code(transaction['type'])
+        timestamp = parse_timestamp(transaction['date'])
+        self.amounts.append(transaction['amount'])
+        try:
+            self.balances.append(transaction['balance'])
+        except (OverflowError, TypeError):
+            self.amounts.pop()
+            raise
+        self.timestamps.append(timestamp)
+        self.types.append(code)
+
+    def add_many(self, kinds, amounts, dates, balances):
+        """Add transactions given as parallel sequences of their fields and return the new length
+
+        Like append, values that do not fit the arrays raise before any column has grown.
+        """
+        amounts = array('q', amounts)
+        balances = array('q', balances)
+        timestamps = array('q', map(parse_timestamp, dates))
+        types = array('B', map(type_code, kinds))
+        self.amounts.extend(amounts)
+        self.balances.extend(balances)
+        self.timestamps.extend(timestamps)
+        self.types.extend(types)
+        return len(self.amounts)
+
+    def extend(self, transactions):
+        """Add several transaction dicts"""
+        for transaction in transactions:
+            self.append(transaction)
+
+    def row(self, index):
+        """Return the transaction at a position as a new dict"""
+        return {
+            'type': TYPE_NAMES[self.types[index]],
+            'amount': self.amounts[index],
+            'date': format_timestamp(self.timestamps[index]),
+            'balance': self.balances[index]
+        }
+
+    def column(self, key):
+        """Return the values of one transaction field in history order, for sorting"""
+        if key == 'date':
+            return self.timestamps
+        if key == 'amount':
+            return self.amounts
+        if key == 'balance':
+            return self.balances
+        if key == 'type':
+            return [TYPE_NAMES[code] for code in self.types]
+        raise KeyError(key)
+
+    def sort_key(self, key):
+        """Return a function mapping a position to its value of a transaction field"""
+        if key == 'type':
+            types = self.types
+            return lambda index: TYPE_NAMES[types[index]]
+        return self.column(key).__getitem__
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._rows(range(*index.indices(len(self)))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("transaction index out of range")
+        return self.row(index)
+
+    def __iter__(self):
+        return self._rows(range(len(self)))
+
+    def _rows(self, indexes):
+        """Yield the transactions at some positions as new dicts, formatting each run of equal dates once"""
+        types, amounts, timestamps, balances = self.types, self.amounts, self.timestamps, self.balances
+        timestamp = date = None
+        for index in indexes:
+            if timestamps[index] != timestamp:
+                timestamp = timestamps[index]
+                date = format_timestamp(timestamp)
+            yield {
+                'type': TYPE_NAMES[types[index]],
+                'amount': amounts[index],
+                'date': date,
+                'balance': balances[index]
+            }
@@ -0,0 +1,518 @@
+"""UI-free banking core: validation and bookkeeping on top of a storage backend"""
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing import get_context
+
+from checkpoints import verify
+from columns import DATE_FORMAT, TYPE_NAMES, period_bounds
+from money import MAX_BALANCE, PAISE_PER_RUPEE, parse_paise
+from passwords import PasswordHasher
+from stats import LIFETIME
+from storage import SORT_KEYS
+
+
+MIN_INITIAL_DEPOSIT = 100 * PAISE_PER_RUPEE
+MIN_PASSWORD_LENGTH = 4
+SUMMARY_MONTHS = 6
+
+_now_cache = (None, None)
+
+
+class LedgerError(ValueError):
+    """Raised when an operation is rejected; the message is shown to the user as is"""
+
+
+def parse_amount(value):
+    """Parse a user-entered rupee amount (string or number) into integer paise"""
+    try:
+        return parse_paise(value)
+    except ValueError:
+        raise LedgerError("Please enter a valid amount!") from None
+
+
+class AccountLocks:
+    """Per-account thread locks, always taken in sorted username order
+
+    Every operation locks all the accounts it touches up front and in the same
+    global order, so concurrent multi-account operations such as transfers can
+    never wait on each other in a cycle.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def _lock(self, username):
+        """Return the lock of an account, creating it on first use"""
+        lock = self._locks.get(username)
+        if lock is None:
+            with self._guard:
+                lock = self._locks.setdefault(username, threading.Lock())
+        return lock
+
+    def acquire(self, *usernames):
+        """Take the locks of all given accounts and return them for release"""
+        locks = [self._lock(username) for username in sorted(set(usernames), key=str)]
+        for lock in locks:
+            lock.acquire()
+        return locks
+
+    @staticmethod
+    def release(locks):
+        """Release locks returned by acquire; any thread may do this"""
+        for lock in reversed(locks):
+            lock.release()
+
+    @contextmanager
+    def hold(self, *usernames):
+        """Hold the locks of all given accounts for the duration of a with block"""
+        locks = self.acquire(*usernames)
+        try:
+            yield
+        finally:
+            self.release(locks)
+
+
+class Ledger:
+    """Register, authenticate, deposit, withdraw and transfer without any user interface
+
+    Amounts are passed in as rupees (strings or numbers) and every balance and
+    transaction amount the ledger returns or stores is integer paise.
+
+    Operations on different accounts may run concurrently from several threads;
+    operations on the same account are serialized by its lock. The *_async
+    variants return as soon as their write is queued and keep the account locks
+    until it is durable, so many threads' writes share one group commit.
+    """
+
+    def __init__(self, storage, passwords=None):
+        self.storage = storage
+        self.passwords = passwords if passwords is not None else PasswordHasher()
+        self.locks = AccountLocks()
+
+    def load(self):
+        """Open the storage backend"""
+        self.storage.load()
+
+    def compact(self):
+        """Compact the storage backend's on-disk data"""
+        self.storage.compact()
+
+    def deferred_compaction(self):
+        """Hold back the storage's background compactions for a with block, e.g. a bulk import"""
+        return self.storage.deferred_compaction()
+
+    def close(self):
+        """Close the storage backend and stop the password workers"""
+        self.storage.close()
+        self.passwords.close()
+
+    def register(self, username, password, initial_deposit):
+        """Create an account with an initial deposit and return it without its password"""
+        with self.locks.hold((username or '').strip()):
+            change = self._validate_register(username, password, initial_deposit, set())
+            self._hash_passwords([change])
+            self.storage.write_batch([change])
+        return _without_password(change[2])
+
+    def authenticate(self, username, password):
+        """Return True if the username exists and the password matches
+
+        Plaintext passwords from earlier versions, and hashes made with a
+        different cost, are replaced by a fresh hash after a successful check.
+        """
+        account = self.storage.get_account(username)
+        if account is None or not self.passwords.verify(password, account['password']):
+            return False
+        if self.passwords.needs_rehash(account['password']):
+            with self.locks.hold(username):
+                account = self.storage.get_account(username)
+                if self.passwords.needs_rehash(account['password']):
+                    hashed = self.passwords.hash(password)
+                    self.storage.write_batch([('password', username, hashed)])
+                    self.passwords.cache.add(password, hashed)
+        return True
+
+    def authenticate_async(self, username, password):
+        """Run authenticate on a password worker thread and return its Future"""
+        return self.passwords.submit(self.authenticate, username, password)
+
+    def balance(self, username):
+        """Return the current balance of an account"""
+        account = self.storage.get_account(username)
+        if account is None:
+            raise LedgerError("Account does not exist!")
+        return account['balance']
+
+    def transaction_count(self, username, filters=None):
+        """Return the number of transactions of an account, or of those matching filters"""
+        return self.storage.transaction_count(username, _history_filters(filters))
+
+    def usernames(self):
+        """Return the usernames of all accounts"""
+        return self.storage.usernames()
+
+    def history(self, username, offset=0, limit=None, sort='date', descending=False,
+                filters=None):
+        """Return a page of transactions sorted by date, type, amount or balance
+
+        filters may hold 'start' and 'end' dates (inclusive 'YYYY', 'YYYY-MM',
+        'YYYY-MM-DD' or full dates), a list of 'types' and 'min_amount' and
+        'max_amount' in rupees; empty values are ignored.
+        """
+        if sort not in SORT_KEYS:
+            raise LedgerError(f"Unknown sort key: {sort}")
+        if offset < 0 or (limit is not None and limit < 0):
+            raise LedgerError("Offset and limit must not be negative!")
+        return self.storage.get_transactions(username, offset, limit, sort, descending,
+                                             _history_filters(filters))
+
+    def stats(self, username, period=LIFETIME):
+        """Return an account's rollup for 'all', a 'YYYY-MM' month or a 'YYYY-MM-DD' day
+
+        Periods without transactions return None.
+        """
+        if not self.storage.account_exists(username):
+            raise LedgerError("Account does not exist!")
+        return self.storage.get_stats(username, period)
+
+    def summary(self, username, months=SUMMARY_MONTHS):
+        """Return the lifetime, today's and the last months' rollups of an account
+
+        Months are listed newest first as (month, rollup or None) pairs.
+        """
+        now = datetime.now()
+        year, month = now.year, now.month
+        recent = []
+        for _ in range(months):
+            key = f"{year:04d}-{month:02d}"
+            recent.append((key, self.stats(username, key)))
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+        return {
+            'lifetime': self.stats(username),
+            'today': self.stats(username, now.strftime("%Y-%m-%d")),
+            'months': recent
+        }
+
+    def balance_as_of(self, username, date):
+        """Return an account's balance at the end of a date such as '2025-07' or '2025-07-15'
+
+        Found by bisecting the account's dates, so it costs O(log n) however long
+        the history is.
+        """
+        self.balance(username)
+        try:
+            end = period_bounds(date)[1]
+        except ValueError:
+            raise LedgerError("Dates must look like YYYY, YYYY-MM or YYYY-MM-DD!") from None
+        return self.storage.balance_as_of(username, end)
+
+    def audit(self, username, full=False):
+        """Return the integrity problems of an account's history; empty if it checks out
+
+        Only the transactions after the last checkpoint are checked unless full.
+        """
+        with self.locks.hold(username):
+            self.balance(username)
+            return verify(*self.storage.audit_rows(username, full))
+
+    def audit_all(self, full=False, workers=None):
+        """Audit every account in worker processes and return (checked, {username: problems})
+
+        The storage is compacted first so that the workers can read complete
+        files; nothing may write to it until this returns.
+        """
+        self.storage.compact()
+        tasks = self.storage.audit_tasks(full)
+        checked = 0
+        failures = {}
+        with ProcessPoolExecutor(workers, mp_context=get_context('spawn')) as pool:
+            for count, found in pool.map(_run_task, tasks):
+                checked += count
+                failures.update(found)
+        return checked, failures
+
+    def rebuild_stats(self, username=None):
+        """Recompute the rollups of one account, or of all accounts, from their transactions"""
+        usernames = [username] if username is not None else self.usernames()
+        for name in usernames:
+            with self.locks.hold(name):
+                if not self.storage.account_exists(name):
+                    raise LedgerError("Account does not exist!")
+                self.storage.rebuild_stats(name)
+        return len(usernames)
+
+    def deposit(self, username, amount):
+        """Deposit an amount and return the transaction record"""
+        return self.deposit_async(username, amount).result()
+
+    def deposit_async(self, username, amount):
+        """Queue a deposit and return a Future of its transaction record
+
+        Rejected deposits raise LedgerError right away; the future completes
+        once the deposit is durable.
+        """
+        def prepare():
+            return [self._validate_transaction('deposit', username, amount,
+                                               self.balance(username))]
+        return self._commit_async((username,), prepare)
+
+    def withdraw(self, username, amount):
+        """Withdraw an amount and return the transaction record"""
+        return self.withdraw_async(username, amount).result()
+
+    def withdraw_async(self, username, amount):
+        """Queue a withdrawal and return a Future of its transaction record, like deposit_async"""
+        def prepare():
+            return [self._validate_transaction('withdraw', username, amount,
+                                               self.balance(username))]
+        return self._commit_async((username,), prepare)
+
+    def transfer(self, username, recipient, amount):
+        """Move an amount to another account and return the sender's transaction record
+
+        Both accounts are debited and credited in a single storage write, so a
+        crash can never leave only one side of the transfer recorded.
+        """
+        return self.transfer_async(username, recipient, amount).result()
+
+    def transfer_async(self, username, recipient, amount):
+        """Queue a transfer and return a Future of the sender's transaction record, like deposit_async"""
+        def prepare():
+            balances = {username: self.balance(username)}
+            if recipient != username:
+                balances[recipient] = self._recipient_balance(recipient)
+            return self._validate_transfer(username, recipient, amount, balances)
+        return self._commit_async((username, recipient), prepare)
+
+    def _commit_async(self, usernames, prepare):
+        """Lock accounts, queue the changes prepare() returns and unlock once they are durable
+
+        Later operations on the same accounts wait for the locks, so they always
+        see this one's result. Returns a Future of the first change's record.
+        """
+        locks = self.locks.acquire(*usernames)
+        try:
+            changes = prepare()
+            written = self.storage.write_batch_async(changes)
+        except BaseException:
+            self.locks.release(locks)
+            raise
+        result = Future()
+
+        def settle(written):
+            self.locks.release(locks)
+            error = written.exception()
+            if error is not None:
+                result.set_exception(error)
+            else:
+                result.set_result(changes[0][2])
+
+        written.add_done_callback(settle)
+        return result
+
+    def apply_batch(self, operations):
+        """Validate and apply many operations with a single persistence flush
+
+        Each operation is a dict with an 'op' of 'register', 'deposit',
+        'withdraw' or 'transfer', a 'username', an 'amount' and, for
+        registrations, a 'password' or, for transfers, a 'recipient'.
+        Operations are validated in order against the balances left by the ones
+        before them. Valid operations are committed together; the returned list
+        holds, per operation, its record or the LedgerError that rejected it.
+        All transactions of a batch are dated when it is validated.
+        """
+        usernames = {name for operation in operations
+                     for name in (operation.get('username'), operation.get('recipient'))
+                     if isinstance(name, str)}
+        usernames.update([name.strip() for name in usernames])
+
+        results = []
+        changes = []
+        balances = {}
+        registered = set()
+        date = _now()
+        with self.locks.hold(*usernames):
+            for operation in operations:
+                try:
+                    kind = operation.get('op')
+                    username = operation.get('username')
+                    recipient = operation.get('recipient')
+                    if not (username is None or isinstance(username, str)) or \
+                            not (recipient is None or isinstance(recipient, str)):
+                        raise LedgerError("Usernames must be text!")
+                    if kind == 'deposit' or kind == 'withdraw':
+                        # Imports are almost all deposits and withdrawals, so they skip the
+                        # list handling below
+                        balance = balances.get(username)
+                        if balance is None:
+                            balance = self.balance(username)
+                        change = self._validate_transaction(kind, username, operation.get('amount'),
+                                                            balance, date)
+                        transaction = change[2]
+                        balances[username] = transaction['balance']
+                        changes.append(change)
+                        results.append(transaction)
+                        continue
+                    if kind == 'register':
+                        new_changes = [self._validate_register(
+                            username, operation.get('password'), operation.get('amount'),
+                            registered, date)]
+                        registered.add(new_changes[0][1])
+                    elif kind == 'transfer':
+                        if username not in balances:
+                            balances[username] = self.balance(username)
+                        if recipient not in balances and recipient != username:
+                            balances[recipient] = self._recipient_balance(recipient)
+                        new_changes = self._validate_transfer(
+                            username, recipient, operation.get('amount'), balances, date)
+                    else:
+                        raise LedgerError(f"Unknown operation: {kind}")
+                except LedgerError as e:
+                    results.append(e)
+                    continue
+                for change in new_changes:
+                    balances[change[1]] = change[2]['balance']
+                changes.extend(new_changes)
+                results.append(_without_password(new_changes[0][2])
+                               if kind == 'register' else new_changes[0][2])
+            if changes:
+                self._hash_passwords(changes)
+                self.storage.write_batch(changes)
+        return results
+
+    def _hash_passwords(self, changes):
+        """Replace the plaintext passwords of validated registrations with salted hashes"""
+        accounts = [change[2] for change in changes if change[0] == 'register']
+        if not accounts:
+            return
+        hashes = self.passwords.hash_many([account['password'] for account in accounts])
+        for account, hashed in zip(accounts, hashes):
+            account['password'] = hashed
+
+    def _recipient_balance(self, recipient):
+        """Return the balance of a transfer recipient"""
+        try:
+            return self.balance(recipient)
+        except LedgerError:
+            raise LedgerError("Recipient account does not exist!") from None
+
+    def _validate_register(self, username, password, initial_deposit, pending, date=None):
+        """Check a registration and return its storage change, dated date or now"""
+        username = (username or '').strip()
+        if not username or not password:
+            raise LedgerError("Username and password are required!")
+        if username in pending or self.storage.account_exists(username):
+            raise LedgerError("Username already exists!")
+        if len(password) < MIN_PASSWORD_LENGTH:
+            raise LedgerError(f"Password must be at least {MIN_PASSWORD_LENGTH} characters!")
+        try:
+            amount = parse_amount(initial_deposit)
+        except LedgerError:
+            raise LedgerError("Invalid initial deposit amount!") from None
+        if amount < MIN_INITIAL_DEPOSIT:
+            raise LedgerError("Initial deposit must be at least "
+                              f"₹{MIN_INITIAL_DEPOSIT // PAISE_PER_RUPEE}!")
+        account = {
+            'password': password,
+            'balance': amount,
+            'transactions': [_transaction('Initial Deposit', amount, amount, date)]
+        }
+        return ('register', username, account)
+
+    def _validate_transaction(self, kind, username, amount, current_balance, date=None):
+        """Check a deposit or withdrawal against a balance and return its storage change, dated date or now"""
+        amount = _positive_amount(amount)
+        if kind == 'withdraw':
+            if amount > current_balance:
+                raise LedgerError("Insufficient funds!")
+            transaction = _transaction('Withdrawal', amount, current_balance - amount, date)
+        else:
+            transaction = _transaction('Deposit', amount, _credited(current_balance, amount), date)
+        return ('transaction', username, transaction)
+
+    def _validate_transfer(self, username, recipient, amount, balances, date=None):
+        """Check a transfer against the current balances and return its two storage changes, dated date or now"""
+        if recipient == username:
+            raise LedgerError("Cannot transfer to the same account!")
+        amount = _positive_amount(amount)
+        if amount > balances[username]:
+            raise LedgerError("Insufficient funds!")
+        return [
+            ('transaction', username,
+             _transaction('Transfer Out', amount, balances[username] - amount, date)),
+            ('transaction', recipient,
+             _transaction('Transfer In', amount, _credited(balances[recipient], amount), date)),
+        ]
+
+
+def _run_task(task):
+    """Call a (function, args) pair in a worker process"""
+    function, args = task
+    return function(*args)
+
+
+def _history_filters(filters):
+    """Convert user-entered history filters to the storage form, or None if nothing filters"""
+    if not filters:
+        return None
+    query = {}
+    try:
+        if filters.get('start'):
+            query['start'] = period_bounds(filters['start'])[0]
+        if filters.get('end'):
+            query['end'] = period_bounds(filters['end'])[1]
+    except (AttributeError, TypeError, ValueError):
+        raise LedgerError("Dates must look like YYYY, YYYY-MM or YYYY-MM-DD!") from None
+    if filters.get('types'):
+        unknown = [kind for kind in filters['types'] if kind not in TYPE_NAMES]
+        if unknown:
+            raise LedgerError(f"Unknown transaction type: {unknown[0]}")
+        query['types'] = list(filters['types'])
+    for key in ('min_amount', 'max_amount'):
+        if filters.get(key) not in (None, ''):
+            query[key] = parse_amount(filters[key])
+    return query or None
+
+
+def _without_password(account):
+    """Return a copy of an account record safe to hand back to callers"""
+    return {key: value for key, value in account.items() if key != 'password'}
+
+
+def _positive_amount(value):
+    """Parse an amount that must be greater than zero"""
+    amount = parse_amount(value)
+    if amount <= 0:
+        raise LedgerError("Amount must be greater than 0!")
+    return amount
+
+
+def _credited(balance, amount):
+    """Return a balance plus an amount, rejecting results the storage cannot hold"""
+    if balance + amount > MAX_BALANCE:
+        raise LedgerError("This would take the balance over the maximum allowed!")
+    return balance + amount
+
+
+def _transaction(kind, amount, balance, date=None):
+    """Build a transaction record dated date, or now"""
+    return {
+        'type': kind,
+        'amount': amount,
+        'date': date or _now(),
+        'balance': balance
+    }
+
+
+def _now():
+    """Return the current local time in DATE_FORMAT, formatting it once per second"""
+    global _now_cache
+    second = int(time.time())
+    cached = _now_cache
+    if cached[0] != second:
+        cached = _now_cache = (second, datetime.fromtimestamp(second).strftime(DATE_FORMAT))
+    return cached[1]
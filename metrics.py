@@ -0,0 +1,255 @@
+"""Optional latency histograms and counters in Prometheus text format
+
+Instrumentation is off by default and then costs next to nothing: methods are
+only wrapped by instrument() once metrics are enabled, and the few hooks inside
+storage code check REGISTRY.enabled before doing any work.
+
+    metrics.enable()
+    metrics.instrument_ledger(ledger)
+    metrics.serve(port=9100)        # GET /metrics
+    print(metrics.REGISTRY.render())
+"""
+import functools
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bounds in seconds, from a cached read to a slow disk sync or compaction
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+OPERATION_SECONDS = 'banking_operation_seconds'
+OPERATIONS_TOTAL = 'banking_operations_total'
+BYTES_WRITTEN_TOTAL = 'banking_bytes_written_total'
+COMMITTED_WRITES_TOTAL = 'banking_committed_writes_total'
+WRITER_QUEUE_DEPTH = 'banking_writer_queue_depth'
+
+LEDGER_OPERATIONS = ('register', 'authenticate', 'balance', 'transaction_count', 'history',
+                     'stats', 'summary', 'deposit', 'withdraw', 'transfer', 'deposit_async',
+                     'withdraw_async', 'transfer_async', 'apply_batch',
+                     '_validate_transaction', '_validate_transfer', '_hash_passwords')
+STORAGE_OPERATIONS = ('load', 'get_account', 'get_transactions', 'transaction_count',
+                      'write_batch_async', 'compact')
+UI_OPERATIONS = ('register', 'finish_register', 'login', 'finish_login', 'process_deposit', 'process_withdraw',
+                 'process_transfer', 'finish_transaction', 'show_history', 'show_summary', 'finish_summary',
+                 'finish_refresh_account', 'update_balance_display', 'save_data')
+
+HELP = {
+    OPERATION_SECONDS: "Latency of instrumented operations",
+    OPERATIONS_TOTAL: "Instrumented calls by outcome (ok or the exception type)",
+    BYTES_WRITTEN_TOTAL: "Bytes written to data files",
+    COMMITTED_WRITES_TOTAL: "Writes made durable by group commits",
+    WRITER_QUEUE_DEPTH: "Writes queued or running on a background writer",
+}
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record one sample"""
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Yield (upper bound, samples at or below it) pairs ending with '+Inf'"""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry:
+    """Named, labelled counters, gauges and histograms that any thread may update"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        """Add amount to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """Set a gauge to value"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """Add a sample to a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def reset(self):
+        """Forget every sample"""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """Return all metrics as a JSON-serializable dict"""
+        with self._lock:
+            return {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self._counters.items())],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in sorted(self._gauges.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': h.count,
+                                'sum': h.sum, 'buckets': list(h.cumulative())}
+                               for (name, labels), h in sorted(self._histograms.items())],
+            }
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, values in (('counter', self._counters), ('gauge', self._gauges)):
+                for name in sorted({name for name, _ in values}):
+                    lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric, labels), value in sorted(values.items()):
+                        if metric == name:
+                            lines.append(f"{name}{_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def _labels(labels):
+    """Format label pairs as {name="value",...}"""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def enable(registry=REGISTRY):
+    """Start recording metrics"""
+    registry.enabled = True
+
+
+def timed(function, operation, registry=REGISTRY):
+    """Wrap a callable so each call's latency and outcome are recorded under operation"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not registry.enabled:
+            return function(*args, **kwargs)
+        outcome = 'ok'
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except BaseException as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            registry.observe(OPERATION_SECONDS, time.perf_counter() - start, operation=operation)
+            registry.inc(OPERATIONS_TOTAL, operation=operation, outcome=outcome)
+    return wrapper
+
+
+def instrument(obj, methods, prefix, registry=REGISTRY):
+    """Time the named methods of one object, recorded as operation '<prefix>.<method>'
+
+    Only this object's bound methods are replaced, so other instances, and
+    everything when metrics are never enabled, run unwrapped.
+    """
+    for method in methods:
+        function = getattr(obj, method, None)
+        if function is not None:
+            setattr(obj, method, timed(function, f"{prefix}.{method.lstrip('_')}", registry))
+
+
+def instrument_ledger(ledger, registry=REGISTRY):
+    """Time a ledger's operations and, for a local one, its storage backend's"""
+    instrument(ledger, LEDGER_OPERATIONS, 'ledger', registry)
+    storage = getattr(ledger, 'storage', None)
+    if storage is not None:
+        instrument(storage, STORAGE_OPERATIONS, 'storage', registry)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Answer GET /metrics with the registry in Prometheus text format"""
+
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host="127.0.0.1", port=9100, registry=REGISTRY):
+    """Serve GET /metrics on a daemon thread and return the HTTP server"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def dump_on_signal(stream=None, registry=REGISTRY):
+    """Write the metrics to stream (default stderr) whenever the process gets SIGUSR1
+
+    The signal handler only wakes a daemon thread that does the writing:
+    rendering takes the registry's lock, which the interrupted thread may be
+    holding. Does nothing on platforms without SIGUSR1.
+    """
+    if not hasattr(signal, 'SIGUSR1'):
+        return
+    requested = threading.Event()
+
+    def dump():
+        while True:
+            requested.wait()
+            requested.clear()
+            (stream or sys.stderr).write(registry.render())
+            (stream or sys.stderr).flush()
+
+    threading.Thread(target=dump, name="metrics-dump", daemon=True).start()
+    signal.signal(signal.SIGUSR1, lambda signum, frame: requested.set())
@@ -0,0 +1,97 @@
+"""Exact money handling: amounts are integer paise everywhere in the ledger and on disk
+
+Floats cannot represent most rupee amounts exactly, so repeated ``balance +=
+amount`` drifts away from the sum of the transactions. Storing paise as ints
+keeps every balance exact, and parsing plain decimal strings by hand keeps
+Decimal (and its context overhead) off the hot path.
+"""
+from decimal import Decimal, InvalidOperation
+
+
+PAISE_PER_RUPEE = 100
+CURRENCY = "₹"
+# Largest amount parse_paise accepts (₹10 lakh crore), far inside the int64
+# range that the transaction columns and SQLite store
+MAX_AMOUNT = 10 ** 15
+# Largest balance an account may reach: the int64 limit of those columns
+MAX_BALANCE = 2 ** 63 - 1
+
+_DIGITS = frozenset('0123456789')
+# Whole rupee parts this long cannot exceed MAX_AMOUNT
+_FAST_DIGITS = len(str(MAX_AMOUNT // PAISE_PER_RUPEE)) - 1
+
+
+def parse_paise(value):
+    """Convert a rupee amount (string or number) to integer paise
+
+    Raises ValueError for anything that is not a finite amount with at most two
+    decimal places, or whose size exceeds MAX_AMOUNT paise.
+    """
+    if type(value) is str:
+        # Plain amounts such as '2500.00' or '120' are by far the most common
+        whole, dot, fraction = value.partition('.')
+        if whole.isdecimal() and len(whole) <= _FAST_DIGITS:
+            if len(fraction) == 2 and fraction.isdecimal():
+                return int(whole + fraction)
+            if not dot:
+                return int(whole) * PAISE_PER_RUPEE
+            if len(fraction) == 1 and fraction.isdecimal():
+                return int(whole + fraction) * 10
+    elif isinstance(value, int) and not isinstance(value, bool):
+        return _bounded(value * PAISE_PER_RUPEE, value)
+    text = str(value).strip()
+    sign = -1 if text.startswith('-') else 1
+    body = text[1:] if text[:1] in ('-', '+') else text
+    whole, _, fraction = body.partition('.')
+    if (whole or fraction) and len(fraction) <= 2 \
+            and _DIGITS.issuperset(whole) and _DIGITS.issuperset(fraction):
+        # Longer digit strings are out of range anyway; don't convert them
+        if len(whole) > 20:
+            raise ValueError(f"Amount too large: {text}")
+        return _bounded(sign * (int(whole or '0') * PAISE_PER_RUPEE
+                                + int(fraction.ljust(2, '0'))), text)
+    return _parse_paise_slow(text)
+
+
+def _bounded(paise, value):
+    """Return paise, or raise ValueError if its size exceeds MAX_AMOUNT"""
+    if abs(paise) > MAX_AMOUNT:
+        raise ValueError(f"Amount too large: {value}")
+    return paise
+
+
+def _parse_paise_slow(text):
+    """Parse forms the fast path does not handle, such as exponents, via Decimal"""
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {text}") from None
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount: {text}")
+    if amount.adjusted() > 13 or abs(amount) > MAX_AMOUNT // PAISE_PER_RUPEE:
+        raise ValueError(f"Amount too large: {text}")
+    paise = amount * PAISE_PER_RUPEE
+    if paise != paise.to_integral_value():
+        raise ValueError(f"More than two decimal places: {text}")
+    return int(paise)
+
+
+def legacy_to_paise(value):
+    """Convert a float rupee value from the pre-paise data format to paise"""
+    if isinstance(value, float):
+        return int((Decimal(repr(value)) * PAISE_PER_RUPEE).to_integral_value())
+    return value
+
+
+def format_rupees(paise):
+    """Format paise as a plain rupee amount that parse_paise reads back, e.g. 123456 -> '1234.56'"""
+    rupees, rest = divmod(abs(paise), PAISE_PER_RUPEE)
+    sign = '-' if paise < 0 else ''
+    return f"{sign}{rupees}.{rest:02d}"
+
+
+def format_amount(paise):
+    """Format paise for display, e.g. 123456 -> '₹1234.56'"""
+    rupees, rest = divmod(abs(paise), PAISE_PER_RUPEE)
+    sign = '-' if paise < 0 else ''
+    return f"{sign}{CURRENCY}{rupees}.{rest:02d}"
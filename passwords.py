@@ -0,0 +1,154 @@
+"""Salted password hashing with a verification cache and a worker pool
+
+Passwords are stored as ``pbkdf2_sha256$<iterations>$<salt>$<hash>``. The
+iteration count is tunable; hashes made with a different count, and plaintext
+passwords left from earlier versions, are upgraded after the next successful
+login. Because each check deliberately costs tens of milliseconds, recent
+successful checks are remembered for a while and checks can run on worker
+threads (hashlib releases the GIL while hashing) so they never block the Tk
+main loop or the server's event loop.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+ALGORITHM = "pbkdf2_sha256"
+DEFAULT_ITERATIONS = 200000
+SALT_BYTES = 16
+
+
+def hash_password(password, iterations=DEFAULT_ITERATIONS):
+    """Return a salted hash string for a password"""
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f"{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def is_hashed(stored):
+    """Return True if a stored password is a hash rather than legacy plaintext"""
+    return stored.startswith(ALGORITHM + "$")
+
+
+def check_password(password, stored):
+    """Compare a password with a stored hash, or with legacy plaintext, in constant time"""
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    try:
+        _, iterations, salt, digest = stored.split('$')
+        expected = bytes.fromhex(digest)
+        actual = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'),
+                                     bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+class VerificationCache:
+    """Bounded, TTL-evicting set of recently verified (password, stored hash) pairs
+
+    Entries are keyed by an HMAC under a per-process random key, so neither
+    passwords nor anything that could be brute-forced offline is kept in memory.
+    Because the stored hash is part of the key, changing a password invalidates
+    its entries.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry_key(self, password, stored):
+        """Derive the cache key of a password/hash pair"""
+        message = stored.encode('utf-8') + b'\0' + password.encode('utf-8')
+        return hmac.new(self._key, message, 'sha256').digest()
+
+    def contains(self, password, stored):
+        """Return True if the pair was verified within the last ttl seconds"""
+        key = self._entry_key(password, stored)
+        now = time.monotonic()
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is None:
+                return False
+            if expires < now:
+                del self._entries[key]
+                return False
+            return True
+
+    def add(self, password, stored):
+        """Remember a successful verification, evicting the oldest entries beyond the bound"""
+        key = self._entry_key(password, stored)
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Forget all entries"""
+        with self._lock:
+            self._entries.clear()
+
+
+class PasswordHasher:
+    """Hash and verify passwords with a tunable cost, a verification cache and worker threads"""
+
+    def __init__(self, iterations=DEFAULT_ITERATIONS, workers=None, cache=None):
+        self.iterations = iterations
+        self.cache = cache if cache is not None else VerificationCache()
+        self._workers = workers or min(8, os.cpu_count() or 1)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """Thread pool for hashing, started on first use"""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self._workers,
+                                                        thread_name_prefix="password")
+        return self._executor
+
+    def hash(self, password):
+        """Return a new salted hash of a password"""
+        return hash_password(password, self.iterations)
+
+    def hash_many(self, passwords):
+        """Hash several passwords in parallel on the worker threads"""
+        return list(self.executor.map(self.hash, passwords))
+
+    def verify(self, password, stored):
+        """Check a password against a stored value, answering from the cache when possible"""
+        if self.cache.contains(password, stored):
+            return True
+        if not check_password(password, stored):
+            return False
+        self.cache.add(password, stored)
+        return True
+
+    def needs_rehash(self, stored):
+        """Return True if a stored value is plaintext or was hashed with another cost"""
+        if not is_hashed(stored):
+            return True
+        try:
+            return int(stored.split('$')[1]) != self.iterations
+        except (IndexError, ValueError):
+            return True
+
+    def submit(self, function, *args):
+        """Run a function on the worker threads and return its Future"""
+        return self.executor.submit(function, *args)
+
+    def close(self):
+        """Stop the worker threads"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,417 @@
+"""Multi-client banking server and the matching client
+
+Requests and responses are JSON objects, one per line. A request names an
+'op' and its parameters plus an optional 'id' that is echoed back:
+
+    {"id": 1, "op": "deposit", "username": "alice", "amount": "250"}
+    {"id": 1, "ok": true, "result": {"type": "Deposit", ...}}
+    {"id": 2, "ok": false, "error": "Insufficient funds!", "kind": "rejected"}
+
+Apart from register and authenticate, every operation acts on behalf of the
+account the connection last authenticated as; requests naming another
+'username' are rejected. Transfers may name any account as 'recipient'.
+
+Run it with ``python server.py --port 8765`` and point the Tk client at it with
+``python banking_system.py --server 127.0.0.1:8765``.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from ledger import Ledger, LedgerError
+from stats import LIFETIME
+from storage import add_storage_arguments, storage_from_args
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Operation name -> (Ledger method, request parameters in call order)
+OPERATIONS = {
+    'register': ('register', ('username', 'password', 'amount')),
+    'authenticate': ('authenticate', ('username', 'password')),
+    'balance': ('balance', ('username',)),
+    'transaction_count': ('transaction_count', ('username', 'filters')),
+    'history': ('history', ('username', 'offset', 'limit', 'sort', 'descending', 'filters')),
+    'stats': ('stats', ('username', 'period')),
+    'summary': ('summary', ('username',)),
+    'balance_as_of': ('balance_as_of', ('username', 'date')),
+    'audit': ('audit', ('username', 'full')),
+    'deposit': ('deposit', ('username', 'amount')),
+    'withdraw': ('withdraw', ('username', 'amount')),
+    'transfer': ('transfer', ('username', 'recipient', 'amount')),
+}
+
+# Writes that are queued on a worker thread and then awaited without holding it,
+# so concurrent requests share the storage backend's group commits
+QUEUED_OPERATIONS = frozenset(('deposit', 'withdraw', 'transfer'))
+
+# Operations that do not need the connection to be logged in to their account
+PUBLIC_OPERATIONS = frozenset(('register', 'authenticate'))
+
+# Values of optional request parameters that were left out
+PARAMETER_DEFAULTS = {'offset': 0, 'limit': None, 'sort': 'date', 'descending': False,
+                      'period': LIFETIME, 'filters': None, 'full': False}
+
+# JSON types each request parameter may have
+PARAMETER_TYPES = {
+    'username': str, 'recipient': str, 'password': str, 'amount': (str, int, float),
+    'offset': int, 'limit': (int, type(None)), 'sort': str, 'descending': bool,
+    'period': str, 'filters': (dict, type(None)), 'date': str, 'full': bool,
+}
+
+
+class AsyncAccountLocks:
+    """One asyncio lock per account, created on demand and dropped when unused
+
+    Like ledger.AccountLocks, several accounts are always locked in sorted
+    username order so that concurrent transfers cannot deadlock.
+    """
+
+    def __init__(self):
+        self._locks = {}
+
+    async def acquire(self, *usernames):
+        """Wait for exclusive use of the given accounts"""
+        for username in sorted(set(usernames), key=str):
+            entry = self._locks.get(username)
+            if entry is None:
+                entry = self._locks[username] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            await entry[0].acquire()
+
+    def release(self, *usernames):
+        """Give up accounts; a lock is forgotten once nobody holds or waits for it"""
+        for username in set(usernames):
+            entry = self._locks[username]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[username]
+
+
+class LedgerServer:
+    """Serve a Ledger to many clients, serializing work per account only
+
+    Each request runs on a worker thread while holding the lock of the account
+    it touches, so requests for different accounts proceed concurrently and a
+    slow disk write for one account does not stall the others. A connection may
+    pipeline requests; responses carry the request id and can arrive out of order.
+    """
+
+    def __init__(self, ledger, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.ledger = ledger
+        self.host = host
+        self.port = port
+        self.locks = AsyncAccountLocks()
+        self._server = None
+
+    async def start(self):
+        """Start listening; returns once the socket is bound"""
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """Start listening and serve until cancelled"""
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def handle_request(self, request, session):
+        """Run one request and return its response dict
+
+        session is the connection's state; a successful authenticate records
+        the username it is logged in as there.
+        """
+        response = {'id': request.get('id')}
+        try:
+            method, params = OPERATIONS[request.get('op')]
+        except (KeyError, TypeError):
+            response.update(ok=False, error=f"Unknown operation: {request.get('op')}",
+                            kind='rejected')
+            return response
+        args = [request.get(name, PARAMETER_DEFAULTS.get(name)) for name in params]
+        error = _check_parameters(params, args)
+        if error is None and method not in PUBLIC_OPERATIONS and \
+                session.get('username') != args[0]:
+            error = "Please log in to this account first!"
+        if error is not None:
+            response.update(ok=False, error=error, kind='rejected')
+            return response
+        usernames = [request.get(name) for name in ('username', 'recipient') if name in params]
+        loop = asyncio.get_running_loop()
+        await self.locks.acquire(*usernames)
+        try:
+            if method == 'authenticate':
+                # Password checks run on the ledger's hashing pool, not the I/O workers
+                result = await asyncio.wrap_future(self.ledger.authenticate_async(*args))
+                if result:
+                    session['username'] = args[0]
+                elif session.get('username') == args[0]:
+                    del session['username']
+            elif method in QUEUED_OPERATIONS:
+                written = await loop.run_in_executor(
+                    None, getattr(self.ledger, method + '_async'), *args)
+                result = await asyncio.wrap_future(written)
+            else:
+                result = await loop.run_in_executor(None, getattr(self.ledger, method), *args)
+        except LedgerError as e:
+            response.update(ok=False, error=str(e), kind='rejected')
+        except Exception as e:
+            response.update(ok=False, error=f"Failed to save data: {str(e)}", kind='failed')
+        else:
+            response.update(ok=True, result=result)
+        finally:
+            self.locks.release(*usernames)
+        return response
+
+    async def _handle_client(self, reader, writer):
+        """Read pipelined requests from one connection and answer each when it completes"""
+        tasks = set()
+        session = {}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be an object")
+                except ValueError as e:
+                    self._send(writer, {'id': None, 'ok': False, 'error': f"Bad request: {e}",
+                                        'kind': 'rejected'})
+                    continue
+                task = asyncio.ensure_future(self._respond(request, writer, session))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            writer.close()
+
+    async def _respond(self, request, writer, session):
+        """Handle a request and write its response"""
+        self._send(writer, await self.handle_request(request, session))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    def _send(writer, response):
+        """Write one response line"""
+        if not writer.is_closing():
+            writer.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class LedgerClient:
+    """Ledger interface backed by a LedgerServer, for the Tk client and scripts
+
+    Calls are synchronous and may be made from several threads; they share one
+    connection, which account operations need to have authenticated as their
+    account first. Rejections raise LedgerError and server-side failures
+    OSError, exactly as a local Ledger would.
+
+    A call that fails on the connection (a timeout, a reset, or a response to
+    another request) drops it and raises OSError; the next call connects again
+    and logs back in as the account that last authenticated. The failed call
+    is not retried, since the server may have applied it.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._next_id = 0
+        self._credentials = None
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def load(self):
+        """Connect to the server"""
+        with self._lock:
+            self._connect()
+
+    def _connect(self):
+        """Open the connection (caller holds the lock)"""
+        self._sock = socket.create_connection((self.host, self.port), self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile('rwb')
+
+    def _disconnect(self):
+        """Close the connection, if open (caller holds the lock)"""
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    def compact(self):
+        """Nothing to do: the server manages its own storage"""
+
+    def close(self):
+        """Disconnect from the server"""
+        with self._lock:
+            self._disconnect()
+            self._credentials = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def call(self, op, **params):
+        """Send one request and return its result, reconnecting first if the connection was lost"""
+        with self._lock:
+            if self._sock is None:
+                self._reconnect(op)
+            try:
+                response = self._exchange(op, params)
+            except OSError:
+                self._disconnect()
+                raise
+        if response['ok']:
+            return response['result']
+        if response.get('kind') == 'rejected':
+            raise LedgerError(response['error'])
+        raise OSError(response['error'])
+
+    def _exchange(self, op, params):
+        """Send one request and read its response (caller holds the lock)"""
+        self._next_id += 1
+        request = dict(params, op=op, id=self._next_id)
+        self._file.write((json.dumps(request) + '\n').encode('utf-8'))
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Connection to the banking server was closed")
+        response = json.loads(line)
+        if response.get('id') != request['id']:
+            raise ConnectionError("The banking server answered a different request")
+        return response
+
+    def _reconnect(self, op):
+        """Connect again and log back in before op, unless op logs in itself (caller holds the lock)"""
+        self._connect()
+        if self._credentials is None or op == 'authenticate':
+            return
+        username, password = self._credentials
+        try:
+            response = self._exchange('authenticate', {'username': username, 'password': password})
+        except OSError:
+            self._disconnect()
+            raise
+        if not (response['ok'] and response['result']):
+            self._credentials = None
+
+    def register(self, username, password, initial_deposit):
+        """Create an account with an initial deposit and return it"""
+        return self.call('register', username=username, password=password,
+                         amount=initial_deposit)
+
+    def authenticate(self, username, password):
+        """Return True if the username exists and the password matches
+
+        The connection stays logged in as that account, also after a reconnect.
+        """
+        authenticated = self.call('authenticate', username=username, password=password)
+        with self._lock:
+            if authenticated:
+                self._credentials = (username, password)
+            elif self._credentials is not None and self._credentials[0] == username:
+                self._credentials = None
+        return authenticated
+
+    def authenticate_async(self, username, password):
+        """Run authenticate on a background thread and return its Future"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="client")
+        return self._executor.submit(self.authenticate, username, password)
+
+    def balance(self, username):
+        """Return the current balance of an account"""
+        return self.call('balance', username=username)
+
+    def transaction_count(self, username, filters=None):
+        """Return the number of transactions of an account, or of those matching filters"""
+        return self.call('transaction_count', username=username, filters=filters)
+
+    def history(self, username, offset=0, limit=None, sort='date', descending=False,
+                filters=None):
+        """Return a page of filtered transactions sorted by date, type, amount or balance"""
+        return self.call('history', username=username, offset=offset, limit=limit,
+                         sort=sort, descending=descending, filters=filters)
+
+    def stats(self, username, period=LIFETIME):
+        """Return an account's rollup for 'all', a 'YYYY-MM' month or a 'YYYY-MM-DD' day"""
+        return self.call('stats', username=username, period=period)
+
+    def summary(self, username):
+        """Return the lifetime, today's and the last months' rollups of an account"""
+        return self.call('summary', username=username)
+
+    def balance_as_of(self, username, date):
+        """Return an account's balance at the end of a date such as '2025-07-15'"""
+        return self.call('balance_as_of', username=username, date=date)
+
+    def audit(self, username, full=False):
+        """Return the integrity problems the server finds in an account's history"""
+        return self.call('audit', username=username, full=full)
+
+    def deposit(self, username, amount):
+        """Deposit an amount and return the transaction record"""
+        return self.call('deposit', username=username, amount=amount)
+
+    def withdraw(self, username, amount):
+        """Withdraw an amount and return the transaction record"""
+        return self.call('withdraw', username=username, amount=amount)
+
+    def transfer(self, username, recipient, amount):
+        """Move an amount to another account and return the sender's transaction record"""
+        return self.call('transfer', username=username, recipient=recipient, amount=amount)
+
+
+def _check_parameters(names, values):
+    """Return an error message for the first request parameter of the wrong type, or None"""
+    for name, value in zip(names, values):
+        allowed = PARAMETER_TYPES[name]
+        if not isinstance(value, allowed) or (isinstance(value, bool) and allowed is not bool):
+            return f"Invalid {name}!"
+    return None
+
+
+def parse_address(address):
+    """Split 'host:port' (or just 'port') into a (host, port) pair"""
+    host, _, port = address.rpartition(':')
+    return host or DEFAULT_HOST, int(port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Online Banking System server")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"address to bind (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port to bind (default: {DEFAULT_PORT})")
+    add_storage_arguments(parser)
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="record metrics and serve them at http://127.0.0.1:PORT/metrics")
+    args = parser.parse_args()
+
+    ledger = Ledger(storage_from_args(args))
+    if args.metrics_port is not None:
+        metrics.enable()
+        metrics.instrument_ledger(ledger)
+        metrics.dump_on_signal()
+        metrics.serve(port=args.metrics_port)
+    ledger.load()
+    server = LedgerServer(ledger, args.host, args.port)
+    print(f"Banking server listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ledger.close()
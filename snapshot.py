@@ -0,0 +1,208 @@
+"""Lazily decoded JSON snapshots
+
+Parsing a whole snapshot at startup costs time and memory in proportion to the
+entire bank, although a session only touches a few accounts. Instead, startup
+builds a username -> byte range index, read from a sidecar file written with
+the snapshot or, when that is missing or stale, found by scanning the
+memory-mapped snapshot. Each account is decoded from its byte range the first
+time it is used, and compaction copies untouched accounts byte for byte.
+"""
+import json
+import mmap
+import os
+import re
+import tempfile
+import threading
+
+
+INDEX_SUFFIX = ".idx"
+
+# Snapshots are written with every account key starting a line indented by
+# exactly two spaces. Nested keys are on that same line (or, in snapshots
+# written with indent=2, indented further) and JSON strings cannot hold raw
+# newlines, so nothing else matches. The literal leading newline (rather
+# than ^) lets re skip ahead with a fast search.
+_ACCOUNT_KEY = re.compile(rb'\n  ("(?:[^"\\\n]|\\.)*"): ')
+_WHITESPACE = b' \t\r\n,'
+
+
+def scan_snapshot(path):
+    """Find the byte range of every account in a snapshot in the layout dump writes
+
+    Returns None when the file is not in that layout (for example a snapshot
+    written without indentation), in which case it has to be parsed in full.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offsets = {}
+            previous = None
+            for match in _ACCOUNT_KEY.finditer(data):
+                if previous is not None:
+                    offsets[previous[0]] = (previous[1], _trim(data, match.start()))
+                previous = (_decode_key(match.group(1)), match.end())
+            end = data.rfind(b'}')
+            if previous is not None:
+                offsets[previous[0]] = (previous[1], _trim(data, end))
+            elif data[:end + 1].strip() != b'{}':
+                return None
+    return offsets
+
+
+def _stamp(stat):
+    """Identify one version of a file by inode, size and modification time"""
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def _decode_key(key):
+    """Decode a quoted JSON key, skipping the JSON parser when it has no escapes"""
+    if b'\\' in key:
+        return json.loads(key)
+    return key[1:-1].decode('utf-8')
+
+
+def _trim(data, end):
+    """Move end back over the whitespace and comma that separate two accounts"""
+    while end > 0 and data[end - 1] in _WHITESPACE:
+        end -= 1
+    return end
+
+
+def read_index(path):
+    """Return the sidecar index of a snapshot, or None if it is missing or out of date"""
+    try:
+        with open(path + INDEX_SUFFIX, 'r') as f:
+            index = json.load(f)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if index.get('stamp') != _stamp(stat):
+        return None
+    return index['accounts']
+
+
+def write_index(path, offsets):
+    """Write the sidecar index of a snapshot, stamped with its file's identity
+
+    Called only once the snapshot is in place, so the stamp is the one a
+    reader sees; a crash before that leaves an index that does not match the
+    snapshot rather than one that wrongly does. The index goes through a
+    uniquely named temporary file, so concurrent writers never share one.
+    """
+    index = {'stamp': _stamp(os.stat(path)), 'accounts': offsets}
+    tmp_file = temporary_file(path + INDEX_SUFFIX)
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(tmp_file, path + INDEX_SUFFIX)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def temporary_file(path):
+    """Create an empty, uniquely named '<path>.<random>.tmp' file next to path and return its name"""
+    directory, name = os.path.split(path)
+    fd, tmp_file = tempfile.mkstemp(suffix=".tmp", prefix=name + ".", dir=directory or os.curdir)
+    os.close(fd)
+    return tmp_file
+
+
+class LazyAccounts:
+    """Dict-like view of a snapshot's accounts that decodes each one on first access
+
+    offsets maps usernames to (start, end) byte ranges of the snapshot file and
+    decode turns those bytes into an account. Decoded, changed and newly added
+    accounts live in loaded; the rest are only ever read from disk.
+    """
+
+    def __init__(self, path, offsets, decode, loaded=None):
+        self.path = path
+        self.offsets = offsets
+        self.loaded = loaded if loaded is not None else {}
+        self._decode = decode
+        self._lock = threading.Lock()
+
+    def get(self, username, default=None):
+        """Return an account, decoding it from the snapshot if it is not loaded yet"""
+        account = self.loaded.get(username)
+        if account is not None:
+            return account
+        if username not in self.offsets:
+            return default
+        with self._lock:
+            account = self.loaded.get(username)
+            if account is None:
+                account = self.loaded[username] = self._decode(self._read(username))
+        return account
+
+    def replace_snapshot(self, new_file, offsets):
+        """Move a rewritten snapshot into place and switch to its byte ranges"""
+        with self._lock:
+            os.replace(new_file, self.path)
+            self.offsets = offsets
+
+    def dump(self, path, default=None):
+        """Write all accounts to path, one per line, and return their byte ranges
+
+        Accounts that were never loaded are copied from the snapshot unchanged.
+        Loaded ones are written without indentation, which json encodes in C.
+        """
+        offsets = {}
+        source = open(self.path, 'rb') if self.offsets else None
+        try:
+            with open(path, 'wb') as f:
+                f.write(b'{')
+                position = 1
+                for username in self:
+                    account = self.loaded.get(username)
+                    if account is None:
+                        value = self._read(username, source)
+                    else:
+                        value = json.dumps(account, default=default).encode('utf-8')
+                    prefix = (b',\n  ' if offsets else b'\n  ') + json.dumps(username).encode() + b': '
+                    f.write(prefix)
+                    f.write(value)
+                    position += len(prefix)
+                    offsets[username] = (position, position + len(value))
+                    position += len(value)
+                f.write(b'\n}' if offsets else b'}')
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            if source is not None:
+                source.close()
+        return offsets
+
+    def _read(self, username, source=None):
+        """Return the raw bytes of an account, from an already open snapshot file if given"""
+        start, end = self.offsets[username]
+        if source is None:
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                return f.read(end - start)
+        source.seek(start)
+        return source.read(end - start)
+
+    def __getitem__(self, username):
+        account = self.get(username)
+        if account is None:
+            raise KeyError(username)
+        return account
+
+    def __setitem__(self, username, account):
+        self.loaded[username] = account
+
+    def __contains__(self, username):
+        return username in self.loaded or username in self.offsets
+
+    def __iter__(self):
+        yield from self.offsets
+        for username in list(self.loaded):
+            if username not in self.offsets:
+                yield username
+
+    def __len__(self):
+        return len(self.offsets) + sum(1 for username in self.loaded
+                                       if username not in self.offsets)
@@ -0,0 +1,145 @@
+"""Incrementally maintained per-account statistics
+
+Every transaction adds its contribution to two rollups of its account: the
+lifetime rollup ('all') and its month ('YYYY-MM'). Updating a rollup is O(1),
+so dashboards read aggregates directly instead of scanning the transaction
+history. A rollup is a dict of about 450 bytes, so one per active day would
+cost more than the transactions it summarizes; a day's rollup ('YYYY-MM-DD')
+is instead computed on request from that day's transactions, which storage
+backends find by date in O(log n).
+"""
+from itertools import compress, groupby
+
+LIFETIME = 'all'
+STAT_FIELDS = ('count', 'inflow', 'outflow', 'largest_withdrawal', 'balance_sum',
+               'min_balance', 'max_balance', 'closing_balance')
+INFLOW_TYPES = frozenset(('Initial Deposit', 'Deposit', 'Transfer In'))
+
+
+def periods(date):
+    """Return the keys of the stored rollups a transaction dated 'YYYY-MM-DD HH:MM:SS' belongs to"""
+    return (LIFETIME, date[:7])
+
+
+def is_day(period):
+    """Return True for a 'YYYY-MM-DD' period, whose rollup is computed rather than stored"""
+    return len(period) == 10
+
+
+def contribution(transaction):
+    """Return the rollup of a single transaction"""
+    amount = transaction['amount']
+    balance = transaction['balance']
+    inflow = transaction['type'] in INFLOW_TYPES
+    return {
+        'count': 1,
+        'inflow': amount if inflow else 0,
+        'outflow': 0 if inflow else amount,
+        'largest_withdrawal': amount if transaction['type'] == 'Withdrawal' else 0,
+        'balance_sum': balance,
+        'min_balance': balance,
+        'max_balance': balance,
+        'closing_balance': balance
+    }
+
+
+def merge(rollup, other):
+    """Add rollup other, which happened after rollup, into rollup in place"""
+    rollup['count'] += other['count']
+    rollup['inflow'] += other['inflow']
+    rollup['outflow'] += other['outflow']
+    rollup['largest_withdrawal'] = max(rollup['largest_withdrawal'], other['largest_withdrawal'])
+    rollup['balance_sum'] += other['balance_sum']
+    rollup['min_balance'] = min(rollup['min_balance'], other['min_balance'])
+    rollup['max_balance'] = max(rollup['max_balance'], other['max_balance'])
+    rollup['closing_balance'] = other['closing_balance']
+
+
+def update_stats(stats, transaction):
+    """Add one transaction to an account's stats dict of period -> rollup
+
+    This runs for every transaction written, so it updates the rollups in place
+    rather than building a contribution and merging it.
+    """
+    kind = transaction['type']
+    amount = transaction['amount']
+    balance = transaction['balance']
+    flow = 'inflow' if kind in INFLOW_TYPES else 'outflow'
+    for period in periods(transaction['date']):
+        rollup = stats.get(period)
+        if rollup is None:
+            stats[period] = contribution(transaction)
+            continue
+        rollup['count'] += 1
+        rollup[flow] += amount
+        if kind == 'Withdrawal' and amount > rollup['largest_withdrawal']:
+            rollup['largest_withdrawal'] = amount
+        rollup['balance_sum'] += balance
+        if balance < rollup['min_balance']:
+            rollup['min_balance'] = balance
+        elif balance > rollup['max_balance']:
+            rollup['max_balance'] = balance
+        rollup['closing_balance'] = balance
+
+
+def add_many_to_stats(stats, kinds, amounts, dates, balances):
+    """Add transactions given as parallel sequences of their fields, oldest first, to an account's stats
+
+    Transactions written together share a date, so each run of equal dates is
+    summed up with builtins and merged into its rollups once.
+    """
+    start = 0
+    for date, run in groupby(dates):
+        end = start + len(list(run))
+        _merge_run(stats, periods(date),
+                   _run_rollup(kinds[start:end], amounts[start:end], balances[start:end]))
+        start = end
+
+
+def _run_rollup(kinds, amounts, balances):
+    """Return the rollup of transactions given as parallel sequences of their fields"""
+    inflow = sum(compress(amounts, map(INFLOW_TYPES.__contains__, kinds)))
+    return {
+        'count': len(amounts),
+        'inflow': inflow,
+        'outflow': sum(amounts) - inflow,
+        'largest_withdrawal': max(compress(amounts, map('Withdrawal'.__eq__, kinds)), default=0),
+        'balance_sum': sum(balances),
+        'min_balance': min(balances),
+        'max_balance': max(balances),
+        'closing_balance': balances[-1]
+    }
+
+
+def _merge_run(stats, keys, run):
+    """Merge the rollup of consecutive transactions into the stored rollups of periods keys"""
+    for period in keys:
+        rollup = stats.get(period)
+        if rollup is None:
+            stats[period] = dict(run)
+        else:
+            merge(rollup, run)
+
+
+def rollup(transactions):
+    """Compute the rollup of some transactions, oldest first, or None if there are none"""
+    total = None
+    for transaction in transactions:
+        if total is None:
+            total = contribution(transaction)
+        else:
+            merge(total, contribution(transaction))
+    return total
+
+
+def build_stats(transactions):
+    """Compute an account's stats from scratch, oldest transaction first"""
+    stats = {}
+    for transaction in transactions:
+        update_stats(stats, transaction)
+    return stats
+
+
+def average_balance(rollup):
+    """Mean balance after each transaction of a rollup, in paise"""
+    return rollup['balance_sum'] // rollup['count'] if rollup['count'] else 0
@@ -0,0 +1,1643 @@
+"""Persistence backends for the banking system"""
+import glob
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import accumulate
+from multiprocessing import get_context
+from pathlib import Path
+
+from checkpoints import CHECKPOINT_EVERY, GENESIS, chain, extend_checkpoints, verify
+from columns import TransactionColumns, format_timestamp, period_bounds, type_code
+from groupcommit import GroupCommitter
+from metrics import BYTES_WRITTEN_TOTAL, OPERATION_SECONDS, REGISTRY
+from money import MAX_BALANCE, legacy_to_paise
+from snapshot import (INDEX_SUFFIX, LazyAccounts, read_index, scan_snapshot, temporary_file,
+                      write_index)
+from stats import LIFETIME, STAT_FIELDS, add_many_to_stats, build_stats, is_day, rollup
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+SORT_KEYS = ('date', 'type', 'amount', 'balance')
+LOCK_SUFFIX = ".lock"
+DEFAULT_SHARDS = 8
+# Accounts per worker task of an audit
+AUDIT_CHUNK = 1000
+
+
+class Storage:
+    """Interface every storage backend implements"""
+
+    def load(self):
+        """Open the backend and make accounts available"""
+        raise NotImplementedError
+
+    def account_exists(self, username):
+        """Return True if the username is registered"""
+        return self.get_account(username) is not None
+
+    def get_account(self, username):
+        """Return a dict with at least 'password' and 'balance', or None"""
+        raise NotImplementedError
+
+    def create_account(self, username, account):
+        """Store a new account together with its initial transactions"""
+        self.write_batch([('register', username, account)])
+
+    def add_transaction(self, username, transaction):
+        """Store a transaction; the account balance becomes the transaction balance"""
+        self.write_batch([('transaction', username, transaction)])
+
+    def write_batch(self, changes):
+        """Durably store ('register', username, account), ('transaction', username,
+        transaction) and ('password', username, hash) changes with a single flush
+        """
+        raise NotImplementedError
+
+    def write_batch_async(self, changes):
+        """Queue changes like write_batch and return a Future that completes once they are durable
+
+        Backends without group commit write synchronously and return a
+        completed future.
+        """
+        future = Future()
+        try:
+            self.write_batch(changes)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+        return future
+
+    def transaction_count(self, username, filters=None):
+        """Return the number of transactions of an account that match filters"""
+        raise NotImplementedError
+
+    def get_transactions(self, username, offset=0, limit=None, sort='date', descending=False,
+                         filters=None):
+        """Return a page of transactions ordered by one of SORT_KEYS
+
+        Rows with equal sort keys are ordered by when they were recorded, newest
+        first when descending. filters is None or a dict with any of 'start'
+        (inclusive) and 'end' (exclusive) timestamps, 'types' (a list of type
+        names) and 'min_amount' and 'max_amount' (inclusive paise).
+        """
+        raise NotImplementedError
+
+    def usernames(self):
+        """Return the usernames of all accounts"""
+        raise NotImplementedError
+
+    def get_stats(self, username, period):
+        """Return an account's rollup for a stats.periods key or a 'YYYY-MM-DD' day as a dict, or None"""
+        raise NotImplementedError
+
+    def rebuild_stats(self, username):
+        """Recompute an account's rollups from its raw transactions"""
+        raise NotImplementedError
+
+    def balance_as_of(self, username, timestamp):
+        """Return the balance after the account's last transaction dated before timestamp, or 0"""
+        raise NotImplementedError
+
+    def audit_rows(self, username, full=False):
+        """Return (transactions, balance, base, checkpoints) for checkpoints.verify
+
+        Unless full, only the transactions after the last checkpoint are read.
+        """
+        raise NotImplementedError
+
+    def audit_tasks(self, full=False):
+        """Return (function, args) pairs that audit every account in worker processes
+
+        Each call returns (accounts checked, {username: problems}) and reads the
+        stored files directly, so they must be complete (compacted) and unchanged
+        while the tasks run.
+        """
+        raise NotImplementedError
+
+    def compact(self):
+        """Make the on-disk representation compact; a no-op where not applicable"""
+
+    @contextmanager
+    def deferred_compaction(self):
+        """Start no background compaction inside the with block; a no-op where not applicable"""
+        yield
+
+    def close(self):
+        """Release files and connections"""
+
+
+class JsonStorage(Storage):
+    """Keep accounts in memory, log each change to a WAL and compact it into a snapshot
+
+    Every account change is appended to the log as a single JSON line, so a
+    deposit costs O(1) I/O no matter how large the bank is. Lines from concurrent
+    writers are group-committed: one write and one fsync cover all of them (see
+    groupcommit.py for the commit_delay and commit_batch knobs). Once enough records
+    have accumulated the log is rotated and a background thread folds it into the
+    snapshot file. Startup only indexes the snapshot; an account is decoded from
+    it the first time it is used (see snapshot.py), and then the log is replayed.
+
+    The process that loads the store holds an exclusive lock on '<snapshot>.lock'
+    until it closes it. Only that owner replaces the snapshot, writes its index or
+    changes its logs; compactions running in worker processes only write new
+    temporary files, so a worker that outlives a killed owner cannot touch the
+    files of the next one.
+    """
+
+    MAX_CACHED_QUERIES = 16
+
+    def __init__(self, data_file="banking_data.json", compact_every=1000,
+                 commit_delay=0.0, commit_batch=1000, executor=None):
+        self.data_file = data_file
+        self.log_file = log_file_of(data_file)
+        self.rotated_file = self.log_file + ".old"
+        self.compact_every = compact_every
+        # Runs the CPU-bound part of compactions, e.g. in another process
+        self.executor = executor
+        self.users = LazyAccounts(data_file, {}, decode_account)
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._log = None
+        self.committer = GroupCommitter(self._write_log, commit_delay, commit_batch,
+                                        name="wal-commit")
+        self._pending = 0
+        # Open deferred_compaction blocks
+        self._deferred = 0
+        self._compactor = None
+        self._owner = None
+        self._sort_orders = {}
+        self._time_indexes = {}
+        self._queries = OrderedDict()
+
+    def load(self):
+        """Index the snapshot and replay the write-ahead log
+
+        Only accounts the log touches are decoded here; the rest are decoded on
+        first use.
+        """
+        self.lock()
+        self.users, rewrite = open_snapshot(self.data_file, save_index=True)
+        replayed = self._replay(self.rotated_file, self.users)
+        replayed += self._replay(self.log_file, self.users)
+        self._log = open(self.log_file, 'ab')
+        self._pending = replayed
+        if rewrite or os.path.exists(self.rotated_file) or replayed >= self.compact_every:
+            with self._lock:
+                self._start_compaction()
+        return self.users
+
+    def lock(self):
+        """Become the owner of the snapshot and its logs; raise OSError if another process is
+
+        Temporary files that an earlier owner or its workers left behind are
+        removed. Does nothing on platforms without fcntl.
+        """
+        if self._owner is not None or fcntl is None:
+            return
+        owner = open(self.data_file + LOCK_SUFFIX, 'ab')
+        try:
+            fcntl.flock(owner.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            owner.close()
+            raise OSError(f"{self.data_file} is in use by another process") from None
+        self._owner = owner
+        for path in glob.glob(glob.escape(self.data_file) + '.*.tmp'):
+            os.remove(path)
+
+    def unlock(self):
+        """Give up ownership of the snapshot and its logs"""
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+
+    def get_account(self, username):
+        """Return the in-memory account record"""
+        return self.users.get(username)
+
+    def write_batch(self, changes):
+        """Log all changes as one atomic record, apply them in memory and wait until durable"""
+        self.write_batch_async(changes).result()
+
+    def write_batch_async(self, changes):
+        """Apply all changes in memory and queue them as one atomic log record
+
+        Callers that must not act on the changes before they are durable wait
+        for the returned future; group commit flushes them with other writers'.
+        The changes are applied first, so a record that cannot be applied is
+        never logged.
+        """
+        record = _batch_record(self._records(changes))
+        apply_record(self.users, record)
+        return self._append(record, len(changes))
+
+    def _records(self, changes):
+        """Turn changes into log records, numbering each account's transactions
+
+        Consecutive transactions share one 'transactions' record that maps each
+        of their accounts to [seq, types, amounts, dates, balances]: the number
+        of transactions the account held before them and their fields as
+        columns, which encode and replay several times faster than a record per
+        transaction. Raises ValueError, before anything is applied or logged,
+        for amounts or balances the transaction columns cannot hold.
+        """
+        records = []
+        counts = {}
+        accounts = None
+        for kind, username, value in changes:
+            if kind == 'transaction':
+                amount = value['amount']
+                balance = value['balance']
+                if not (-MAX_BALANCE <= amount <= MAX_BALANCE
+                        and -MAX_BALANCE <= balance <= MAX_BALANCE):
+                    raise ValueError(f"Amount out of range in a transaction of {username}")
+                if accounts is None:
+                    accounts = {}
+                    records.append({'op': 'transactions', 'accounts': accounts})
+                columns = accounts.get(username)
+                if columns is None:
+                    seq = counts.get(username)
+                    if seq is None:
+                        seq = len(self.users[username]['transactions'])
+                    columns = accounts[username] = [seq, [], [], [], []]
+                columns[1].append(value['type'])
+                columns[2].append(amount)
+                columns[3].append(value['date'])
+                columns[4].append(balance)
+                continue
+            if accounts is not None:
+                for name, columns in accounts.items():
+                    counts[name] = columns[0] + len(columns[1])
+                accounts = None
+            if kind == 'register':
+                for transaction in value['transactions']:
+                    if not (-MAX_BALANCE <= transaction['amount'] <= MAX_BALANCE
+                            and -MAX_BALANCE <= transaction['balance'] <= MAX_BALANCE):
+                        raise ValueError(f"Amount out of range in a transaction of {username}")
+                records.append({'op': 'register', 'user': username, 'account': value})
+                counts[username] = len(value['transactions'])
+            else:
+                records.append({'op': 'password', 'user': username, 'password': value})
+        return records
+
+    def transaction_count(self, username, filters=None):
+        """Return the number of transactions of an account that match filters"""
+        if filters:
+            return len(self._query(username, filters, 'date'))
+        return len(self.users[username]['transactions'])
+
+    def usernames(self):
+        """Return the usernames of all in-memory accounts"""
+        return list(self.users)
+
+    def get_stats(self, username, period):
+        """Return a copy of a rollup kept alongside the in-memory account
+
+        A day's rollup is computed from the day's transactions, found by
+        bisecting the time index.
+        """
+        if is_day(period):
+            try:
+                start, end = period_bounds(period)
+            except ValueError:
+                return None
+            transactions = self.users[username]['transactions']
+            times, order, _ = self._time_index(username)
+            positions = range(bisect_left(times, start), bisect_left(times, end))
+            if order is not None:
+                positions = sorted(order[i] for i in positions)
+            return rollup(transactions.row(i) for i in positions)
+        stored = self.users[username]['stats'].get(period)
+        return dict(stored) if stored is not None else None
+
+    def balance_as_of(self, username, timestamp):
+        """Bisect the time index for the last transaction before timestamp: O(log n)"""
+        transactions = self.users[username]['transactions']
+        times, order, latest = self._time_index(username)
+        count = bisect_left(times, timestamp)
+        if count == 0:
+            return 0
+        # With out-of-order dates, the latest recorded of the earlier transactions
+        position = count - 1 if order is None else latest[count - 1]
+        return transactions.balances[position]
+
+    def audit_rows(self, username, full=False):
+        """Return the in-memory account's history after its last checkpoint, or all of it"""
+        return _account_audit_rows(self.users[username], full)
+
+    def audit_tasks(self, full=False):
+        """Audit the snapshot in chunks of AUDIT_CHUNK accounts"""
+        usernames = self.usernames()
+        return [(audit_snapshot, (self.data_file, usernames[first:first + AUDIT_CHUNK], full))
+                for first in range(0, len(usernames), AUDIT_CHUNK)]
+
+    def rebuild_stats(self, username):
+        """Log a rebuild so it survives compaction, then recompute from the columns"""
+        record = {'op': 'stats', 'user': username}
+        future = self._append(record)
+        apply_record(self.users, record)
+        future.result()
+
+    def get_transactions(self, username, offset=0, limit=None, sort='date', descending=False,
+                         filters=None):
+        """Return a page of the in-memory transaction list
+
+        Transactions are recorded in date order, so date pages are plain index
+        ranges; other sort keys use a cached permutation of the list. Filtered
+        pages come from a cached list of matching positions.
+        """
+        transactions = self.users[username]['transactions']
+        if filters:
+            positions = self._query(username, filters, sort)
+            count = len(positions)
+            end = count if limit is None else min(count, offset + limit)
+            if descending:
+                return [transactions[positions[count - 1 - i]] for i in range(offset, end)]
+            return [transactions[positions[i]] for i in range(offset, end)]
+        count = len(transactions)
+        end = count if limit is None else min(count, offset + limit)
+        if sort == 'date':
+            if not descending:
+                return transactions[offset:end]
+            return [transactions[count - 1 - i] for i in range(offset, end)]
+        order = self._sort_order(username, sort)
+        if descending:
+            return [transactions[order[count - 1 - i]] for i in range(offset, end)]
+        return [transactions[order[i]] for i in range(offset, end)]
+
+    def _sort_order(self, username, sort):
+        """Return transaction positions sorted by a key, rebuilt when the account changed"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        transactions = self.users[username]['transactions']
+        cached = self._sort_orders.get((username, sort))
+        if cached is None or cached[0] != len(transactions):
+            order = sorted(range(len(transactions)), key=transactions.sort_key(sort))
+            cached = (len(order), order)
+            self._sort_orders[(username, sort)] = cached
+        return cached[1]
+
+    def _time_index(self, username):
+        """Return (timestamps in ascending order, their positions, the latest position
+        among the first k of them for each k), both None if in recorded order
+
+        History is normally recorded in time order, so the timestamp column
+        itself is the index and only new rows are checked. Once the clock has
+        run backwards a sorted copy is kept instead, and later rows are inserted
+        into it by bisection rather than sorting it again.
+        """
+        timestamps = self.users[username]['transactions'].timestamps
+        count = len(timestamps)
+        entry = self._time_indexes.get(username)
+        if entry is None or entry[0] > count:
+            checked = 0
+            if all(timestamps[i - 1] <= timestamps[i] for i in range(1, count)):
+                entry = (count, None, timestamps, None)
+            else:
+                order = array('q', sorted(range(count), key=timestamps.__getitem__))
+                entry = (count, order, array('q', (timestamps[i] for i in order)),
+                         array('q', accumulate(order, max)))
+            self._time_indexes[username] = entry
+        elif entry[0] < count:
+            checked, order, times, latest = entry
+            if order is None:
+                checked = next((i for i in range(max(checked, 1), count)
+                                if timestamps[i - 1] > timestamps[i]), count)
+                if checked < count:
+                    order = array('q', range(checked))
+                    times = array('q', timestamps[:checked])
+                    latest = array('q', range(checked))
+            if order is not None:
+                for i in range(checked, count):
+                    position = bisect_right(times, timestamps[i])
+                    times.insert(position, timestamps[i])
+                    order.insert(position, i)
+                    # Row i is the latest recorded, so every prefix holding it ends there
+                    latest[position:] = array('q', [i]) * (len(latest) - position + 1)
+            entry = (count, order, timestamps if order is None else times, latest)
+            self._time_indexes[username] = entry
+        return entry[2], entry[1], entry[3]
+
+    def _query(self, username, filters, sort):
+        """Return the positions of an account's transactions matching filters, sorted by a key
+
+        The date range is found by bisecting the time index, so only the k
+        transactions inside it are examined: O(log n + k) for date order. The
+        last few results are cached until the account changes.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        transactions = self.users[username]['transactions']
+        key = (username, sort, tuple(sorted((name, tuple(value) if name == 'types' else value)
+                                            for name, value in filters.items())))
+        cached = self._queries.get(key)
+        if cached is not None and cached[0] == len(transactions):
+            self._queries.move_to_end(key)
+            return cached[1]
+        count = len(transactions)
+        times, order, _ = self._time_index(username)
+        low, high = 0, count
+        if filters.get('start') is not None:
+            low = bisect_left(times, filters['start'], 0, count)
+        if filters.get('end') is not None:
+            high = bisect_left(times, filters['end'], low, count)
+        positions = range(low, high) if order is None else order[low:high]
+        if filters.get('types'):
+            codes = {type_code(name) for name in filters['types']}
+            types = transactions.types
+            positions = [i for i in positions if types[i] in codes]
+        amounts = transactions.amounts
+        if filters.get('min_amount') is not None:
+            positions = [i for i in positions if amounts[i] >= filters['min_amount']]
+        if filters.get('max_amount') is not None:
+            positions = [i for i in positions if amounts[i] <= filters['max_amount']]
+        if sort == 'date':
+            positions = list(positions)
+        else:
+            positions = sorted(positions, key=transactions.sort_key(sort))
+        self._queries[key] = (count, positions)
+        if len(self._queries) > self.MAX_CACHED_QUERIES:
+            self._queries.popitem(last=False)
+        return positions
+
+    def compact(self):
+        """Fold the write-ahead log into the snapshot file and wait for it to finish
+
+        Does nothing once the log is empty, so compacting an unchanged store
+        does not rewrite the snapshot.
+        """
+        while True:
+            with self._lock:
+                # A background compaction that is already running only covers
+                # the log up to its rotation; wait for it, then fold the rest
+                running = self._compactor is not None and self._compactor.is_alive()
+                if not running:
+                    if self._pending == 0 and not os.path.exists(self.rotated_file):
+                        break
+                    self._start_compaction()
+                compactor = self._compactor
+            if compactor is not None:
+                compactor.join()
+            if not running:
+                break
+        if os.path.exists(self.rotated_file):
+            raise OSError(f"Compaction of {self.rotated_file} did not complete")
+
+    @contextmanager
+    def deferred_compaction(self):
+        """Start no compaction inside the with block, then one for all changes made in it
+
+        A compaction rewrites every account its log touches, so a bulk import
+        that started one each compact_every changes would rewrite the same
+        accounts over and over.
+        """
+        with self._lock:
+            self._deferred += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._deferred -= 1
+                if not self._deferred and self._pending >= self.compact_every:
+                    self._start_compaction()
+
+    def close(self):
+        """Flush queued writes, wait for a running compaction, close the write-ahead log and unlock"""
+        self.committer.close()
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+        self.unlock()
+
+    def _append(self, record, size=1):
+        """Queue one record line (holding size changes) for the write-ahead log
+
+        Returns the future of its group commit.
+        """
+        data = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+        return self._append_line(data, size)
+
+    def _append_line(self, data, size=1):
+        """Queue an already encoded record line like _append and return the future of its commit"""
+        with self._lock:
+            future = self.committer.submit(data)
+            self._pending += size
+            if self._pending >= self.compact_every and not self._deferred:
+                self._start_compaction()
+        return future
+
+    def _write_log(self, lines):
+        """Write a group of queued record lines to the log with a single fsync"""
+        data = b''.join(lines)
+        with self._log_lock:
+            self._log.write(data)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+        if REGISTRY.enabled:
+            REGISTRY.inc(BYTES_WRITTEN_TOTAL, len(data), file='wal')
+
+    def _start_compaction(self):
+        """Rotate the log and compact it on a background thread (caller holds the lock)"""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        # A leftover rotated log from an interrupted compaction is compacted first;
+        # the live log keeps growing and is rotated on the next round.
+        if not os.path.exists(self.rotated_file):
+            # Lines queued but not yet flushed land in the new log, which is
+            # replayed after the rotated one, so they stay in order
+            with self._log_lock:
+                self._log.close()
+                os.replace(self.log_file, self.rotated_file)
+                self._log = open(self.log_file, 'ab')
+            self._pending = 0
+        self._compactor = threading.Thread(target=self._compact, daemon=True)
+        self._compactor.start()
+
+    def _compact(self):
+        """Write snapshot + rotated log to a new snapshot, then drop the rotated log
+
+        Only the accounts the rotated log touches are decoded; all others are
+        copied from the old snapshot as raw bytes. The live accounts switch to
+        the new file's byte ranges as it is moved into place, and only then is
+        it indexed.
+        """
+        start = time.perf_counter()
+        if self.executor is not None:
+            tmp_file, offsets = self.executor.submit(
+                compact_snapshot, self.data_file, [self.rotated_file]).result()
+        else:
+            tmp_file, offsets = compact_snapshot(self.data_file, [self.rotated_file])
+        if REGISTRY.enabled:
+            REGISTRY.inc(BYTES_WRITTEN_TOTAL, os.path.getsize(tmp_file), file='snapshot')
+        self.users.replace_snapshot(tmp_file, offsets)
+        write_index(self.data_file, offsets)
+        os.remove(self.rotated_file)
+        if REGISTRY.enabled:
+            REGISTRY.observe(OPERATION_SECONDS, time.perf_counter() - start,
+                             operation='storage.compaction')
+
+    @staticmethod
+    def _replay(log_file, users, repair=True):
+        """Apply every complete record of a log to users and return how many were read
+
+        A torn final line left by a crash mid-append is cut off, if repair is
+        set, so later appends start on a clean line. Only the owner repairs logs.
+        """
+        if not os.path.exists(log_file):
+            return 0
+        count = 0
+        with open(log_file, 'rb+' if repair else 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    if repair:
+                        f.truncate(offset)
+                    break
+                apply_record(users, record)
+                offset += len(line)
+                count += 1
+        return count
+
+
+def open_snapshot(data_file, save_index=False):
+    """Return (accounts, rewrite) where accounts lazily decodes a snapshot file
+
+    The username -> byte range index comes from the sidecar index file or,
+    if that is missing or stale, from scanning the snapshot, whose index is
+    then written if save_index is set (by the owner only). Snapshots that
+    cannot be indexed are parsed in full and rewrite is True so that the next
+    compaction writes them in the indexable layout. Missing or unreadable
+    snapshots yield no accounts.
+    """
+    if not os.path.exists(data_file):
+        return LazyAccounts(data_file, {}, decode_account), False
+    offsets = read_index(data_file)
+    if offsets is None:
+        offsets = scan_snapshot(data_file)
+        if offsets is not None and save_index:
+            write_index(data_file, offsets)
+    if offsets is not None:
+        return LazyAccounts(data_file, offsets, decode_account), False
+    # Each account's transaction list is packed into columns as soon as it
+    # has been parsed, so at most one account's transaction dicts exist at a time
+    try:
+        with open(data_file, 'r') as f:
+            loaded = json.load(f, object_hook=_decode_object)
+    except (json.JSONDecodeError, FileNotFoundError):
+        return LazyAccounts(data_file, {}, decode_account), False
+    return LazyAccounts(data_file, {}, decode_account, loaded), True
+
+
+def compact_snapshot(data_file, log_files):
+    """Write a snapshot plus logs to a new, uniquely named snapshot file next to it
+
+    Returns (new file, byte ranges) for the owner to move into place and index.
+    Only the accounts the logs touch are decoded; all others are copied as raw
+    bytes. This only reads the snapshot and logs and writes the new file, so it
+    may run in another process.
+    """
+    users = open_snapshot(data_file)[0]
+    for log_file in log_files:
+        JsonStorage._replay(log_file, users, repair=False)
+    tmp_file = temporary_file(data_file)
+    try:
+        offsets = users.dump(tmp_file, default=_encode_columns)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+    return tmp_file, offsets
+
+
+def log_file_of(data_file):
+    """Name of the write-ahead log that belongs to a JSON snapshot"""
+    return os.path.splitext(data_file)[0] + ".wal"
+
+
+def snapshot_is_current(data_file):
+    """Return True if a JSON snapshot can be opened without replaying logs or rescanning it"""
+    log_file = log_file_of(data_file)
+    if os.path.exists(log_file + ".old"):
+        return False
+    if os.path.exists(log_file) and os.path.getsize(log_file) > 0:
+        return False
+    return not os.path.exists(data_file) or read_index(data_file) is not None
+
+
+def fold_logs_of(data_file):
+    """The write-ahead logs that fold_logs folds into a JSON snapshot, oldest first"""
+    log_file = log_file_of(data_file)
+    return [log_file + ".old", log_file]
+
+
+def fold_logs(data_file, compacted=None):
+    """Fold a JSON snapshot's write-ahead logs into it and index it
+
+    compacted is the result of compact_snapshot(data_file, fold_logs_of(data_file))
+    when that already ran, e.g. in a worker process; only the owner of the files
+    may call this. Afterwards opening the snapshot is an index read. A crash at
+    any point leaves files that load to the same accounts.
+    """
+    logs = fold_logs_of(data_file)
+    tmp_file, offsets = compacted or compact_snapshot(data_file, logs)
+    os.replace(tmp_file, data_file)
+    write_index(data_file, offsets)
+    for log in logs:
+        if os.path.exists(log):
+            os.remove(log)
+
+
+class SqliteStorage(Storage):
+    """Accounts and transactions in indexed SQLite tables
+
+    Nothing is loaded up front: logins and balance reads are primary-key lookups
+    and history pages are range scans over the (username, date) index, so startup
+    time and memory do not grow with the number of stored transactions. The
+    connection is shared between threads and serialized by a lock.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS accounts (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            balance INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL REFERENCES accounts(username),
+            type TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            balance INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_transactions_username
+            ON transactions (username);
+        CREATE INDEX IF NOT EXISTS idx_transactions_username_date
+            ON transactions (username, date);
+        CREATE TABLE IF NOT EXISTS account_stats (
+            username TEXT NOT NULL REFERENCES accounts(username),
+            period TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            inflow INTEGER NOT NULL,
+            outflow INTEGER NOT NULL,
+            largest_withdrawal INTEGER NOT NULL,
+            balance_sum INTEGER NOT NULL,
+            min_balance INTEGER NOT NULL,
+            max_balance INTEGER NOT NULL,
+            closing_balance INTEGER NOT NULL,
+            PRIMARY KEY (username, period)
+        );
+        CREATE TABLE IF NOT EXISTS account_checkpoints (
+            username TEXT NOT NULL REFERENCES accounts(username),
+            position INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            checksum TEXT NOT NULL,
+            PRIMARY KEY (username, position)
+        );
+    """
+
+    # Adds a batch's rollup to a stored one, creating the row if needed
+    STATS_UPSERT = """
+        INSERT INTO account_stats (username, period, count, inflow, outflow,
+            largest_withdrawal, balance_sum, min_balance, max_balance, closing_balance)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (username, period) DO UPDATE SET
+            count = count + excluded.count,
+            inflow = inflow + excluded.inflow,
+            outflow = outflow + excluded.outflow,
+            largest_withdrawal = max(largest_withdrawal, excluded.largest_withdrawal),
+            balance_sum = balance_sum + excluded.balance_sum,
+            min_balance = min(min_balance, excluded.min_balance),
+            max_balance = max(max_balance, excluded.max_balance),
+            closing_balance = excluded.closing_balance
+    """
+
+    def __init__(self, db_file="banking_data.db", commit_delay=0.0, commit_batch=1000):
+        self.db_file = db_file
+        self._conn = None
+        self._page_size = None
+        self._lock = threading.Lock()
+        self.committer = GroupCommitter(self._commit, commit_delay, commit_batch,
+                                        name="sqlite-commit")
+
+    # Version 1 stores amounts as INTEGER paise; version 0 databases hold REAL rupees.
+    # Version 2 adds the account_stats rollups, version 3 account_checkpoints and
+    # version 4 drops the day rollups, which are now computed on request.
+    SCHEMA_VERSION = 4
+
+    def load(self):
+        """Open the database, create the schema if needed and migrate older versions"""
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        has_tables = self._conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'accounts'").fetchone()[0]
+        if has_tables and version < 1:
+            self._migrate_to_paise()
+        self._conn.executescript(self.SCHEMA)
+        if has_tables and version < 2:
+            for username in self.usernames():
+                self.rebuild_stats(username)
+        if has_tables and version < 3:
+            with self._lock, self._conn:
+                for (username,) in self._conn.execute("SELECT username FROM accounts").fetchall():
+                    self._extend_checkpoints(username)
+        if has_tables and version < 4:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM account_stats WHERE length(period) = 10")
+        self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def _migrate_to_paise(self):
+        """Rebuild version 0 tables with REAL rupee columns as INTEGER paise"""
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DROP INDEX IF EXISTS idx_transactions_username")
+            self._conn.execute("DROP INDEX IF EXISTS idx_transactions_username_date")
+            self._conn.execute("ALTER TABLE accounts RENAME TO accounts_v0")
+            self._conn.execute("ALTER TABLE transactions RENAME TO transactions_v0")
+            for statement in self.SCHEMA.split(';'):
+                if statement.strip():
+                    self._conn.execute(statement)
+            self._conn.execute(
+                "INSERT INTO accounts (username, password, balance) "
+                "SELECT username, password, CAST(ROUND(balance * 100) AS INTEGER) "
+                "FROM accounts_v0")
+            self._conn.execute(
+                "INSERT INTO transactions (id, username, type, amount, date, balance) "
+                "SELECT id, username, type, CAST(ROUND(amount * 100) AS INTEGER), date, "
+                "CAST(ROUND(balance * 100) AS INTEGER) FROM transactions_v0")
+            self._conn.execute("DROP TABLE transactions_v0")
+            self._conn.execute("DROP TABLE accounts_v0")
+
+    def get_account(self, username):
+        """Look up an account by primary key"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT password, balance FROM accounts WHERE username = ?",
+                (username,)).fetchone()
+        if row is None:
+            return None
+        return {'password': row[0], 'balance': row[1]}
+
+    def write_batch(self, changes):
+        """Insert accounts and transactions and update balances in one database transaction"""
+        self.write_batch_async(changes).result()
+
+    def write_batch_async(self, changes):
+        """Queue changes for the next group commit, which covers all writers' queued batches
+
+        The changes become visible to reads when the returned future completes.
+        """
+        accounts = []
+        balances = {}
+        passwords = []
+        # Each account's new transaction rows; they are inserted together, which
+        # keeps the index updates local, and summed into one upsert per rollup
+        grouped = {}
+        for kind, username, value in changes:
+            if kind == 'register':
+                accounts.append((username, value['password'], value['balance']))
+                new_transactions = value['transactions']
+            elif kind == 'password':
+                passwords.append((value, username))
+                continue
+            else:
+                balances[username] = value['balance']
+                new_transactions = (value,)
+            rows = grouped.get(username)
+            if rows is None:
+                rows = grouped[username] = []
+            for t in new_transactions:
+                rows.append((username, t['type'], t['amount'], t['date'], t['balance']))
+        balances = [(balance, username) for username, balance in balances.items()]
+        transactions = []
+        stats = []
+        for username, rows in grouped.items():
+            transactions.extend(rows)
+            _, kinds, amounts, dates, row_balances = zip(*rows)
+            rollups = {}
+            add_many_to_stats(rollups, kinds, amounts, dates, row_balances)
+            stats.extend((username, period) + tuple(rollup[field] for field in STAT_FIELDS)
+                         for period, rollup in rollups.items())
+        return self.committer.submit((accounts, transactions, balances, passwords, stats))
+
+    def _commit(self, batches):
+        """Write queued batches in one database transaction
+
+        If that fails, for example because two queued registrations claim the
+        same username or a value does not fit an INTEGER column, each batch is
+        retried in a transaction of its own so that only the offending ones are
+        rejected. Any error is contained this way, so one bad batch can never
+        stop the group committer.
+
+        With metrics on, the growth of the database in pages is counted as the
+        bytes written; rows changed in place do not grow it.
+        """
+        with self._lock:
+            pages = self._page_count() if REGISTRY.enabled else None
+            errors = self._write_batches(batches)
+            if pages is not None:
+                grown = self._page_count() - pages
+                if grown > 0:
+                    REGISTRY.inc(BYTES_WRITTEN_TOTAL, grown * self._page_size, file='sqlite')
+        return errors
+
+    def _write_batches(self, batches):
+        """Write batches in one transaction, or one each if that fails; return their errors or None"""
+        try:
+            with self._conn:
+                for batch in batches:
+                    self._write(*batch)
+            return None
+        except Exception as e:
+            if len(batches) == 1:
+                return [e]
+        errors = []
+        for batch in batches:
+            try:
+                with self._conn:
+                    self._write(*batch)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def _page_count(self):
+        """Number of pages in the database, including those only in its WAL file"""
+        return self._conn.execute("PRAGMA page_count").fetchone()[0]
+
+    def _write(self, accounts, transactions, balances, passwords, stats):
+        """Execute the statements of one batch inside the current transaction"""
+        self._conn.executemany(
+            "INSERT INTO accounts (username, password, balance) VALUES (?, ?, ?)",
+            accounts)
+        self._conn.executemany(
+            "INSERT INTO transactions (username, type, amount, date, balance) "
+            "VALUES (?, ?, ?, ?, ?)", transactions)
+        self._conn.executemany(
+            "UPDATE accounts SET balance = ? WHERE username = ?", balances)
+        self._conn.executemany(
+            "UPDATE accounts SET password = ? WHERE username = ?", passwords)
+        self._conn.executemany(self.STATS_UPSERT, stats)
+        # The lifetime rollups count each account's new transactions
+        added = [(row[0], row[2]) for row in stats if row[1] == LIFETIME]
+        for username, count in added:
+            total = self._conn.execute(
+                "SELECT count FROM account_stats WHERE username = ? AND period = ?",
+                (username, LIFETIME)).fetchone()[0]
+            if total // CHECKPOINT_EVERY > (total - count) // CHECKPOINT_EVERY:
+                self._extend_checkpoints(username)
+
+    def _extend_checkpoints(self, username):
+        """Add the checkpoints that have become due, reading only rows after the last one"""
+        row = self._conn.execute(
+            "SELECT position, last_id, checksum FROM account_checkpoints WHERE username = ? "
+            "ORDER BY position DESC LIMIT 1", (username,)).fetchone()
+        position, last_id, checksum = row if row is not None else (0, 0, GENESIS)
+        while True:
+            rows = self._conn.execute(
+                "SELECT id, type, amount, date, balance FROM transactions "
+                "WHERE username = ? AND id > ? ORDER BY id LIMIT ?",
+                (username, last_id, CHECKPOINT_EVERY)).fetchall()
+            if len(rows) < CHECKPOINT_EVERY:
+                return
+            checksum = chain(checksum, ({'type': r[1], 'amount': r[2], 'date': r[3],
+                                         'balance': r[4]} for r in rows))
+            position += len(rows)
+            last_id = rows[-1][0]
+            self._conn.execute(
+                "INSERT INTO account_checkpoints (username, position, last_id, balance, checksum) "
+                "VALUES (?, ?, ?, ?, ?)", (username, position, last_id, rows[-1][4], checksum))
+
+    def transaction_count(self, username, filters=None):
+        """Count the account's matching transactions using the (username, date) index"""
+        where, params = self._where(username, filters)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM transactions WHERE {where}", params).fetchone()[0]
+
+    def get_transactions(self, username, offset=0, limit=None, sort='date', descending=False,
+                         filters=None):
+        """Read a page of transactions; date order and ranges use the (username, date) index"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        direction = "DESC" if descending else "ASC"
+        where, params = self._where(username, filters)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT type, amount, date, balance FROM transactions WHERE {where} "
+                f"ORDER BY {sort} {direction}, id {direction} LIMIT ? OFFSET ?",
+                params + [-1 if limit is None else limit, offset]).fetchall()
+        return [{'type': r[0], 'amount': r[1], 'date': r[2], 'balance': r[3]}
+                for r in rows]
+
+    @staticmethod
+    def _where(username, filters):
+        """Build the WHERE clause and parameters selecting an account's matching transactions
+
+        Dates are stored as 'YYYY-MM-DD HH:MM:SS' text, which sorts like time, so
+        timestamp bounds become text bounds on the indexed date column.
+        """
+        clauses = ["username = ?"]
+        params = [username]
+        filters = filters or {}
+        if filters.get('start') is not None:
+            clauses.append("date >= ?")
+            params.append(format_timestamp(filters['start']))
+        if filters.get('end') is not None:
+            clauses.append("date < ?")
+            params.append(format_timestamp(filters['end']))
+        if filters.get('types'):
+            clauses.append(f"type IN ({', '.join('?' * len(filters['types']))})")
+            params.extend(filters['types'])
+        if filters.get('min_amount') is not None:
+            clauses.append("amount >= ?")
+            params.append(filters['min_amount'])
+        if filters.get('max_amount') is not None:
+            clauses.append("amount <= ?")
+            params.append(filters['max_amount'])
+        return " AND ".join(clauses), params
+
+    def usernames(self):
+        """Return the usernames of all accounts"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT username FROM accounts")]
+
+    def get_stats(self, username, period):
+        """Read one rollup row by primary key, or compute a day's from the (username, date) index"""
+        if is_day(period):
+            try:
+                start, end = period_bounds(period)
+            except ValueError:
+                return None
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT type, amount, date, balance FROM transactions "
+                    "WHERE username = ? AND date >= ? AND date < ? ORDER BY id",
+                    (username, format_timestamp(start), format_timestamp(end))).fetchall()
+            return rollup({'type': r[0], 'amount': r[1], 'date': r[2], 'balance': r[3]}
+                          for r in rows)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(STAT_FIELDS)} FROM account_stats "
+                "WHERE username = ? AND period = ?", (username, period)).fetchone()
+        return dict(zip(STAT_FIELDS, row)) if row is not None else None
+
+    def balance_as_of(self, username, timestamp):
+        """Read the last earlier transaction from the (username, date) index: O(log n)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT balance FROM transactions WHERE username = ? AND date < ? "
+                "ORDER BY date DESC, id DESC LIMIT 1",
+                (username, format_timestamp(timestamp))).fetchone()
+        return row[0] if row is not None else 0
+
+    def audit_rows(self, username, full=False):
+        """Read the rows after the last checkpoint, found by its transaction id"""
+        with self._lock:
+            return _database_audit_rows(self._conn, username, full)
+
+    def audit_tasks(self, full=False):
+        """Audit the database in chunks of AUDIT_CHUNK accounts over read-only connections"""
+        usernames = self.usernames()
+        return [(audit_database, (self.db_file, usernames[first:first + AUDIT_CHUNK], full))
+                for first in range(0, len(usernames), AUDIT_CHUNK)]
+
+    def rebuild_stats(self, username):
+        """Replace an account's rollup rows with ones recomputed from its transactions"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT type, amount, date, balance FROM transactions "
+                "WHERE username = ? ORDER BY date, id", (username,))
+            stats = build_stats({'type': r[0], 'amount': r[1], 'date': r[2], 'balance': r[3]}
+                                for r in rows)
+            self._conn.execute("DELETE FROM account_stats WHERE username = ?", (username,))
+            self._conn.executemany(
+                f"INSERT INTO account_stats (username, period, {', '.join(STAT_FIELDS)}) "
+                f"VALUES (?, ?{', ?' * len(STAT_FIELDS)})",
+                [(username, period) + tuple(rollup[field] for field in STAT_FIELDS)
+                 for period, rollup in stats.items()])
+
+    def close(self):
+        """Commit queued batches and close the database connection"""
+        self.committer.close()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class ShardedStorage(Storage):
+    """Accounts partitioned over several JSON stores by a stable hash of the username
+
+    Shard i of n lives in '<name>.<i>-of-<n>.json' with its own index and
+    write-ahead log, so a write appends to the log of its account's shard only
+    and every shard group-commits and compacts on its own. Shards that need log
+    replay at startup are recovered, and compactions run, in a pool of worker
+    processes, so both scale with cores. Batches are validated and applied in
+    memory by the owning process, so their throughput is that of one core,
+    close to that of an unsharded store.
+
+    A batch that spans shards, such as a transfer between them, is first made
+    durable as one line of '<name>.cross.wal' and then appended to each shard's
+    log. Startup replays that log into the shards (records are idempotent), so a
+    crash never leaves only part of such a batch applied, and the batch is
+    complete once that line is durable.
+    """
+
+    def __init__(self, data_file="banking_data.json", shards=DEFAULT_SHARDS, compact_every=1000,
+                 commit_delay=0.0, commit_batch=1000, workers=None):
+        if shards < 1:
+            raise ValueError("The number of shards must be at least 1")
+        root, extension = os.path.splitext(data_file)
+        # Shard names need an extension, or they would share one log file name
+        self._root, self._extension = root, extension or ".json"
+        self.data_file = data_file
+        self.shard_files = [f"{root}.{i:02d}-of-{shards:02d}{self._extension}"
+                            for i in range(shards)]
+        self.cross_file = root + ".cross.wal"
+        self.compact_every = compact_every
+        # Worker processes start on first use, so a clean startup spawns none
+        self.executor = ProcessPoolExecutor(workers or min(shards, os.cpu_count() or 1),
+                                            mp_context=get_context('spawn'))
+        self.shards = [JsonStorage(path, compact_every, commit_delay, commit_batch, self.executor)
+                       for path in self.shard_files]
+        self.cross_committer = GroupCommitter(self._write_cross, commit_delay, commit_batch,
+                                              name="cross-commit")
+        self._cross = None
+        self._cross_lock = threading.Lock()
+        self._cross_state = threading.Lock()
+        self._in_flight = 0
+        self._cross_records = 0
+        # Set when a shard failed to log its part of a batch; the cross-shard
+        # log then keeps every line until startup replays it
+        self._cross_kept = False
+
+    @property
+    def committers(self):
+        """Group committers of the cross-shard log and of every shard"""
+        return [self.cross_committer] + [shard.committer for shard in self.shards]
+
+    def shard_index(self, username):
+        """Return the number of the shard that owns a username
+
+        crc32 rather than hash(), which differs between runs.
+        """
+        return zlib.crc32(username.encode('utf-8')) % len(self.shards)
+
+    def shard_of(self, username):
+        """Return the shard that owns a username"""
+        return self.shards[self.shard_index(username)]
+
+    def load(self):
+        """Lock the shards, recover them in parallel, open them and finish interrupted cross-shard batches
+
+        The worker processes only compact the shards' logs into new files; this
+        process, holding every shard's lock, moves them into place. A single
+        unsharded snapshot at data_file is split into the shards first.
+        """
+        self._check_layout()
+        try:
+            for shard in self.shards:
+                shard.lock()
+        except OSError:
+            for shard in self.shards:
+                shard.unlock()
+            raise
+        dirty = [path for path in self.shard_files if not snapshot_is_current(path)]
+        if len(dirty) > 1:
+            compacted = self.executor.map(compact_snapshot, dirty, map(fold_logs_of, dirty))
+            for path, result in zip(dirty, compacted):
+                fold_logs(path, result)
+        for shard in self.shards:
+            shard.load()
+        self._recover_cross()
+        self._cross = open(self.cross_file, 'ab')
+        if os.path.exists(self.data_file) or os.path.exists(log_file_of(self.data_file)):
+            self._split_unsharded()
+
+    def get_account(self, username):
+        """Return the account from its shard, or None for a missing or non-text username"""
+        if not isinstance(username, str):
+            return None
+        return self.shard_of(username).get_account(username)
+
+    def write_batch(self, changes):
+        """Write changes atomically and wait until they are durable"""
+        self.write_batch_async(changes).result()
+
+    def write_batch_async(self, changes):
+        """Queue changes with their shard, or through the cross-shard log if they span several"""
+        parts = {}
+        # Each account's part, as batches such as imports hold many changes per account
+        parts_of = {}
+        for change in changes:
+            part = parts_of.get(change[1])
+            if part is None:
+                part = parts_of[change[1]] = parts.setdefault(self.shard_index(change[1]), [])
+            part.append(change)
+        if len(parts) == 1:
+            (index, part), = parts.items()
+            return self.shards[index].write_batch_async(part)
+        records = {index: _batch_record(self.shards[index]._records(part))
+                   for index, part in parts.items()}
+        # Each part is encoded once, for the cross-shard line and for its shard's log
+        encoded = {index: json.dumps(record, separators=(',', ':')).encode('utf-8')
+                   for index, record in records.items()}
+        line = (b'{"op":"cross","parts":{'
+                + b','.join(b'"%d":%s' % (index, data) for index, data in encoded.items())
+                + b'}}\n')
+        for index, record in records.items():
+            apply_record(self.shards[index].users, record)
+        with self._cross_state:
+            logged = self.cross_committer.submit(line)
+            self._in_flight += 1
+            self._cross_records += 1
+        result = Future()
+
+        def forward(logged):
+            # Only once the whole batch is durable may any shard's log hold part of it
+            try:
+                if logged.exception() is not None:
+                    raise logged.exception()
+                written = [self.shards[index]._append_line(encoded[index] + b'\n',
+                                                           _record_size(record))
+                           for index, record in records.items()]
+            except Exception as e:
+                self._settle_cross(e)
+                result.set_exception(e)
+                return
+            # Startup would finish the batch from the cross-shard log, so callers
+            # need not wait for the shards' commits
+            result.set_result(None)
+            _when_all(written, self._settle_cross)
+
+        logged.add_done_callback(forward)
+        return result
+
+    def transaction_count(self, username, filters=None):
+        """Count matching transactions in the account's shard"""
+        return self.shard_of(username).transaction_count(username, filters)
+
+    def get_transactions(self, username, offset=0, limit=None, sort='date', descending=False,
+                         filters=None):
+        """Read a page of transactions from the account's shard"""
+        return self.shard_of(username).get_transactions(username, offset, limit, sort,
+                                                        descending, filters)
+
+    def usernames(self):
+        """Return the usernames of all shards"""
+        return [username for shard in self.shards for username in shard.usernames()]
+
+    def get_stats(self, username, period):
+        """Return a rollup from the account's shard"""
+        return self.shard_of(username).get_stats(username, period)
+
+    def rebuild_stats(self, username):
+        """Recompute an account's rollups in its shard"""
+        self.shard_of(username).rebuild_stats(username)
+
+    def balance_as_of(self, username, timestamp):
+        """Look the balance up in the account's shard"""
+        return self.shard_of(username).balance_as_of(username, timestamp)
+
+    def audit_rows(self, username, full=False):
+        """Read the history to audit from the account's shard"""
+        return self.shard_of(username).audit_rows(username, full)
+
+    def audit_tasks(self, full=False):
+        """Audit every shard's snapshot as one task"""
+        return [(audit_snapshot, (path, None, full)) for path in self.shard_files]
+
+    def compact(self):
+        """Compact all shards at once; the snapshot rewrites run in the worker processes"""
+        with ThreadPoolExecutor(len(self.shards)) as pool:
+            list(pool.map(JsonStorage.compact, self.shards))
+
+    @contextmanager
+    def deferred_compaction(self):
+        """Defer the compactions of every shard"""
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.deferred_compaction())
+            yield
+
+    def close(self):
+        """Flush queued writes, close every shard and stop the worker processes"""
+        self.cross_committer.close()
+        for shard in self.shards:
+            shard.close()
+        with self._cross_state:
+            if self._cross is not None:
+                if self._in_flight == 0 and not self._cross_kept:
+                    self._truncate_cross()
+                self._cross.close()
+                self._cross = None
+        self.executor.shutdown()
+
+    def _write_cross(self, lines):
+        """Write a group of cross-shard batch lines with a single fsync"""
+        data = b''.join(lines)
+        with self._cross_lock:
+            self._cross.write(data)
+            self._cross.flush()
+            os.fsync(self._cross.fileno())
+        if REGISTRY.enabled:
+            REGISTRY.inc(BYTES_WRITTEN_TOTAL, len(data), file='cross')
+
+    def _settle_cross(self, error):
+        """Count a cross-shard batch as settled and empty the cross-shard log once nothing is in flight"""
+        with self._cross_state:
+            self._in_flight -= 1
+            if error is not None:
+                self._cross_kept = True
+            if (self._in_flight == 0 and self._cross_records >= self.compact_every
+                    and not self._cross_kept):
+                self._truncate_cross()
+
+    def _truncate_cross(self):
+        """Empty the cross-shard log; every line in it is durable in the shards' logs"""
+        with self._cross_lock:
+            self._cross.truncate(0)
+            self._cross.flush()
+            os.fsync(self._cross.fileno())
+        self._cross_records = 0
+
+    def _recover_cross(self):
+        """Append every batch of the cross-shard log to its shards again, then empty the log
+
+        Shards skip records they already hold, and a torn final line was never
+        acknowledged, so it is dropped.
+        """
+        if not os.path.exists(self.cross_file):
+            return
+        written = []
+        with open(self.cross_file, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("incomplete record")
+                    batch = json.loads(line)
+                except ValueError:
+                    break
+                for index, record in batch['parts'].items():
+                    shard = self.shards[int(index)]
+                    apply_record(shard.users, record)
+                    written.append(shard._append(record, _record_size(record)))
+        for future in written:
+            future.result()
+        with open(self.cross_file, 'wb') as f:
+            os.fsync(f.fileno())
+
+    def _check_layout(self):
+        """Refuse to open data that was split into a different number of shards"""
+        if any(os.path.exists(path) for path in self.shard_files):
+            return
+        pattern = re.compile(re.escape(self._root) + r'\.\d+-of-(\d+)'
+                             + re.escape(self._extension) + '$')
+        counts = {int(match.group(1))
+                  for match in map(pattern.match, glob.glob(glob.escape(self._root) + '.*-of-*'))
+                  if match}
+        if counts:
+            raise ValueError(f"{self.data_file} is split into {max(counts)} shards, "
+                             f"not {len(self.shards)}")
+
+    def _split_unsharded(self):
+        """Move the accounts of an unsharded JSON store into the shards, then rename its files
+
+        Registrations of accounts a shard already holds are skipped, so a split
+        interrupted by a crash simply runs again.
+        """
+        source = JsonStorage(self.data_file)
+        source.load()
+        parts = [[] for _ in self.shards]
+        for username in source.usernames():
+            account = source.get_account(username)
+            parts[self.shard_index(username)].append(
+                ('register', username, {'password': account['password'],
+                                        'balance': account['balance'],
+                                        'transactions': list(account['transactions'])}))
+        source.close()
+        for shard, part in zip(self.shards, parts):
+            for first in range(0, len(part), 1000):
+                shard.write_batch(part[first:first + 1000])
+        self.compact()
+        for path in (self.data_file, self.data_file + INDEX_SUFFIX, log_file_of(self.data_file)):
+            if os.path.exists(path):
+                os.replace(path, path + ".unsharded")
+
+
+def _account_audit_rows(account, full):
+    """audit_rows of an in-memory JSON account"""
+    checkpoints = account['checkpoints']
+    if full or not checkpoints:
+        return account['transactions'], account['balance'], None, checkpoints
+    base = checkpoints[-1]
+    return account['transactions'][base[0]:], account['balance'], base, ()
+
+
+def _database_audit_rows(conn, username, full):
+    """audit_rows of an account in an SQLite database"""
+    row = conn.execute("SELECT balance FROM accounts WHERE username = ?", (username,)).fetchone()
+    if row is None:
+        raise KeyError(username)
+    checkpoints = conn.execute(
+        "SELECT position, balance, checksum, last_id FROM account_checkpoints "
+        "WHERE username = ? ORDER BY position", (username,)).fetchall()
+    if full or not checkpoints:
+        base, last_id, inside = None, 0, [list(c[:3]) for c in checkpoints]
+    else:
+        base, last_id, inside = list(checkpoints[-1][:3]), checkpoints[-1][3], ()
+    transactions = [{'type': r[0], 'amount': r[1], 'date': r[2], 'balance': r[3]}
+                    for r in conn.execute(
+                        "SELECT type, amount, date, balance FROM transactions "
+                        "WHERE username = ? AND id > ? ORDER BY id", (username, last_id))]
+    return transactions, row[0], base, inside
+
+
+def audit_snapshot(data_file, usernames=None, full=False):
+    """Audit accounts (default: all) of a compacted JSON snapshot; see Storage.audit_tasks"""
+    users = open_snapshot(data_file)[0]
+    failures = {}
+    usernames = list(users) if usernames is None else usernames
+    for username in usernames:
+        problems = verify(*_account_audit_rows(users[username], full))
+        # Decoded accounts are not needed again
+        users.loaded.pop(username, None)
+        if problems:
+            failures[username] = problems
+    return len(usernames), failures
+
+
+def audit_database(db_file, usernames, full=False):
+    """Audit accounts of an SQLite database over a read-only connection; see Storage.audit_tasks"""
+    conn = sqlite3.connect(Path(db_file).resolve().as_uri() + "?mode=ro", uri=True)
+    try:
+        failures = {}
+        for username in usernames:
+            problems = verify(*_database_audit_rows(conn, username, full))
+            if problems:
+                failures[username] = problems
+    finally:
+        conn.close()
+    return len(usernames), failures
+
+
+def _batch_record(records):
+    """Wrap several log records in one atomic batch record"""
+    return records[0] if len(records) == 1 else {'op': 'batch', 'records': records}
+
+
+def _record_size(record):
+    """Number of changes a log record holds"""
+    if record['op'] == 'batch':
+        return sum(map(_record_size, record['records']))
+    if record['op'] == 'transactions':
+        return sum(len(columns[1]) for columns in record['accounts'].values())
+    return 1
+
+
+def _when_all(futures, callback):
+    """Call callback(first exception or None) once every future is done"""
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        callback(next((f.exception() for f in futures if f.exception() is not None), None))
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+STORAGE_BACKENDS = {
+    'json': (JsonStorage, "banking_data.json"),
+    'sqlite': (SqliteStorage, "banking_data.db"),
+    'sharded': (ShardedStorage, "banking_data.json"),
+}
+
+
+def open_storage(backend="json", path=None, **options):
+    """Create a storage backend by name, using its default file unless path is given
+
+    options, such as commit_delay and commit_batch, go to the backend's constructor.
+    """
+    try:
+        storage_class, default_path = STORAGE_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend: {backend}") from None
+    return storage_class(path or default_path, **options)
+
+
+def add_storage_arguments(parser, data_file=True, group_commit=True):
+    """Add the command-line options that choose and tune a storage backend to a parser
+
+    Tools that pick the data file, or the group commit settings, themselves
+    leave out --data-file or --commit-delay and --commit-batch.
+    """
+    parser.add_argument("--storage", choices=sorted(STORAGE_BACKENDS), default="json",
+                        help="storage backend (default: json)")
+    if data_file:
+        parser.add_argument("--data-file", help="data file of the storage backend")
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS,
+                        help=f"number of shards of the sharded backend (default: {DEFAULT_SHARDS})")
+    if group_commit:
+        add_group_commit_arguments(parser)
+
+
+def add_group_commit_arguments(parser):
+    """Add --commit-delay and --commit-batch to a parser"""
+    parser.add_argument("--commit-delay", type=float, default=0, metavar="MS",
+                        help="wait up to MS milliseconds to group writes into one commit (default: 0)")
+    parser.add_argument("--commit-batch", type=int, default=1000, metavar="N",
+                        help="commit at once when N writes are waiting (default: 1000)")
+
+
+def storage_options_from_args(args):
+    """Return the backend constructor options parsed by add_storage_arguments"""
+    options = {}
+    if getattr(args, 'commit_delay', None) is not None:
+        options['commit_delay'] = args.commit_delay / 1000
+        options['commit_batch'] = args.commit_batch
+    if args.storage == 'sharded':
+        options['shards'] = args.shards
+    return options
+
+
+def storage_from_args(args):
+    """Create the storage backend chosen by the options of add_storage_arguments"""
+    return open_storage(args.storage, getattr(args, 'data_file', None),
+                        **storage_options_from_args(args))
+
+
+def migrate_account(account):
+    """Convert an account still holding float rupees to integer paise; return True if changed
+
+    Old records precede new ones, so an account needs converting exactly when its
+    balance or its first transaction is still a float.
+    """
+    transactions = account['transactions']
+    if not isinstance(account['balance'], float) and \
+            not (transactions and isinstance(transactions[0]['amount'], float)):
+        return False
+    account['balance'] = legacy_to_paise(account['balance'])
+    for transaction in transactions:
+        transaction['amount'] = legacy_to_paise(transaction['amount'])
+        transaction['balance'] = legacy_to_paise(transaction['balance'])
+    return True
+
+
+def decode_account(raw):
+    """Decode one account of the snapshot from its JSON bytes"""
+    return json.loads(raw, object_hook=_decode_object)
+
+
+def _decode_object(obj):
+    """json object_hook converting account records to paise, stats and columns"""
+    transactions = obj.get('transactions')
+    if isinstance(transactions, list) and 'balance' in obj:
+        migrated = migrate_account(obj)
+        if migrated or 'stats' not in obj:
+            obj['stats'] = build_stats(transactions)
+        elif any(is_day(period) for period in obj['stats']):
+            # Snapshots written before day rollups were computed on request
+            obj['stats'] = {period: stored for period, stored in obj['stats'].items()
+                            if not is_day(period)}
+        if migrated or 'checkpoints' not in obj:
+            obj['checkpoints'] = extend_checkpoints([], transactions)
+        obj['transactions'] = TransactionColumns(transactions)
+    return obj
+
+
+def apply_record(users, record):
+    """Apply one log record to users; records already in the snapshot are skipped"""
+    if record['op'] == 'batch':
+        for inner in record['records']:
+            apply_record(users, inner)
+        return
+    if record['op'] == 'transactions':
+        for username, (seq, kinds, amounts, dates, balances) in record['accounts'].items():
+            account = users.get(username)
+            if account is None:
+                continue
+            # Transactions the account already holds are skipped
+            held = len(account['transactions']) - seq
+            if held > 0:
+                kinds, amounts, dates, balances = (kinds[held:], amounts[held:], dates[held:],
+                                                   balances[held:])
+            if kinds:
+                _add_transactions(account, kinds, amounts, dates, balances)
+        return
+    username = record['user']
+    if record['op'] == 'register':
+        if username not in users:
+            account = dict(record['account'])
+            migrate_account(account)
+            account['stats'] = build_stats(account['transactions'])
+            account['checkpoints'] = extend_checkpoints([], account['transactions'])
+            account['transactions'] = TransactionColumns(account['transactions'])
+            users[username] = account
+    elif record['op'] == 'password':
+        if username in users:
+            users[username]['password'] = record['password']
+    elif record['op'] == 'stats':
+        if username in users:
+            users[username]['stats'] = build_stats(users[username]['transactions'])
+    elif record['op'] == 'transaction':
+        account = users.get(username)
+        if account is None or record['seq'] < len(account['transactions']):
+            return
+        transaction = record['transaction']
+        if isinstance(transaction['amount'], float):
+            transaction = dict(transaction, amount=legacy_to_paise(transaction['amount']),
+                               balance=legacy_to_paise(transaction['balance']))
+        _add_transactions(account, (transaction['type'],), (transaction['amount'],),
+                          (transaction['date'],), (transaction['balance'],))
+
+
+def _add_transactions(account, kinds, amounts, dates, balances):
+    """Append transactions, given as parallel sequences of their fields, to an in-memory account
+
+    The account's balance, rollups and checkpoints are updated to match.
+    """
+    transactions = account['transactions']
+    count = transactions.add_many(kinds, amounts, dates, balances)
+    account['balance'] = balances[-1]
+    add_many_to_stats(account['stats'], kinds, amounts, dates, balances)
+    checkpoints = account['checkpoints']
+    if count - (checkpoints[-1][0] if checkpoints else 0) >= CHECKPOINT_EVERY:
+        extend_checkpoints(checkpoints, transactions)
+
+
+def _encode_columns(obj):
+    """json.dump fallback writing TransactionColumns as the usual list of transaction dicts"""
+    if isinstance(obj, TransactionColumns):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
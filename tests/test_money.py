@@ -0,0 +1,67 @@
+"""Parsing and formatting of integer paise amounts
+
+Run with: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from money import (MAX_AMOUNT, PAISE_PER_RUPEE, format_amount, format_rupees,  # noqa: E402
+                   legacy_to_paise, parse_paise)
+
+
+class ParsePaiseTest(unittest.TestCase):
+
+    def test_plain_amounts(self):
+        for text, paise in (("12.34", 1234), ("12", 1200), ("12.5", 1250), (".5", 50),
+                            ("0.05", 5), (" 3.10 ", 310), ("+7", 700), ("-1.5", -150),
+                            ("007.00", 700), (7, 700)):
+            with self.subTest(text=text):
+                self.assertEqual(parse_paise(text), paise)
+
+    def test_forms_the_fast_path_leaves_to_decimal(self):
+        for text, paise in (("1e2", 10000), ("1.5E1", 1500), ("1.230", 123)):
+            with self.subTest(text=text):
+                self.assertEqual(parse_paise(text), paise)
+
+    def test_invalid_amounts(self):
+        for text in ("", ".", "-", "abc", "1.234", "1,000", "1.2.3", "nan", "inf", "-Infinity",
+                     "0x10", "1e-3", True, None):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_paise(text)
+
+    def test_size_limit(self):
+        largest = MAX_AMOUNT // PAISE_PER_RUPEE
+        self.assertEqual(parse_paise(str(largest)), MAX_AMOUNT)
+        self.assertEqual(parse_paise(largest), MAX_AMOUNT)
+        for text in (str(largest + 1), f"-{largest}.01", "9" * 30, largest + 1,
+                     "1e14", "1e999999999"):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_paise(text)
+
+    def test_formatting_reads_back(self):
+        for paise in (0, 5, 50, 1234, -150, MAX_AMOUNT):
+            with self.subTest(paise=paise):
+                self.assertEqual(parse_paise(format_rupees(paise)), paise)
+        self.assertEqual(format_amount(123456), "₹1234.56")
+        self.assertEqual(format_amount(-5), "-₹0.05")
+
+
+class LegacyToPaiseTest(unittest.TestCase):
+
+    def test_floats_round_to_the_nearest_paisa(self):
+        for value, paise in ((1234.56, 123456), (0.1 + 0.2, 30), (100.0, 10000),
+                             (0.01, 1), (-2.5, -250), (1e-05, 0)):
+            with self.subTest(value=value):
+                self.assertEqual(legacy_to_paise(value), paise)
+
+    def test_integers_are_already_paise(self):
+        self.assertEqual(legacy_to_paise(1234), 1234)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+"""Recovery of the sharded JSON store after its owning process is killed
+
+Run with: python -m unittest discover tests
+"""
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import Future
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ledger import Ledger  # noqa: E402
+from passwords import PasswordHasher  # noqa: E402
+from storage import ShardedStorage, compact_snapshot, fold_logs_of  # noqa: E402
+
+ACCOUNTS = 200
+INITIAL = 1000000
+SHARDS = 4
+
+# Moves money between random accounts until it is killed; compactions run in
+# the storage's worker processes all the while
+OWNER = """
+import random, sys
+sys.path.insert(0, sys.argv[1])
+from ledger import Ledger
+from passwords import PasswordHasher
+from storage import ShardedStorage
+
+if __name__ == '__main__':
+    ledger = Ledger(ShardedStorage(sys.argv[2], shards=%d, compact_every=100),
+                    PasswordHasher(iterations=1000))
+    ledger.load()
+    while True:
+        sender, recipient = random.sample(range(%d), 2)
+        ledger.transfer(f"user{sender}", f"user{recipient}", "1.00")
+""" % (SHARDS, ACCOUNTS)
+
+
+def open_ledger(path):
+    """Open the test store with cheap password hashing"""
+    ledger = Ledger(ShardedStorage(path, shards=SHARDS, compact_every=100),
+                    PasswordHasher(iterations=1000))
+    ledger.load()
+    return ledger
+
+
+class RecoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.json")
+        ledger = open_ledger(self.path)
+        results = ledger.apply_batch([{'op': 'register', 'username': f"user{i}",
+                                       'password': "secret", 'amount': str(INITIAL // 100)}
+                                      for i in range(ACCOUNTS)])
+        self.assertFalse([result for result in results if isinstance(result, Exception)])
+        for _ in range(20):
+            ledger.apply_batch([{'op': 'deposit', 'username': f"user{i}", 'amount': "1.00"}
+                                for i in range(ACCOUNTS)]
+                               + [{'op': 'withdraw', 'username': f"user{i}", 'amount': "1.00"}
+                                  for i in range(ACCOUNTS)])
+        ledger.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assert_consistent(self, ledger):
+        """Every balance is where transfers alone can take it and every history audits clean"""
+        total = sum(ledger.balance(f"user{i}") for i in range(ACCOUNTS))
+        self.assertEqual(total, ACCOUNTS * INITIAL)
+        checked, failures = ledger.audit_all(workers=2)
+        self.assertEqual(checked, ACCOUNTS)
+        self.assertEqual(failures, {})
+
+    def test_second_owner_is_refused(self):
+        ledger = open_ledger(self.path)
+        try:
+            with self.assertRaises(OSError):
+                ShardedStorage(self.path, shards=SHARDS).load()
+        finally:
+            ledger.close()
+        open_ledger(self.path).close()
+
+    def test_stale_compaction_leaves_owner_files_alone(self):
+        ledger = open_ledger(self.path)
+        try:
+            ledger.transfer("user0", "user1", "5.00")
+            before = self.files()
+            # What a worker of a killed owner may still be doing
+            for path in ledger.storage.shard_files:
+                compact_snapshot(path, fold_logs_of(path))
+            self.assertEqual(self.files(), before)
+            ledger.transfer("user1", "user0", "5.00")
+        finally:
+            ledger.close()
+        ledger = open_ledger(self.path)
+        try:
+            self.assert_consistent(ledger)
+        finally:
+            ledger.close()
+        self.assertFalse([name for name in os.listdir(self.directory.name)
+                          if name.endswith(".tmp")])
+
+    def test_batch_a_shard_failed_to_log_is_replayed(self):
+        ledger = open_ledger(self.path)
+        try:
+            storage = ledger.storage
+            recipient = next(f"user{i}" for i in range(1, ACCOUNTS)
+                             if storage.shard_index(f"user{i}") != storage.shard_index("user0"))
+            failed = Future()
+            failed.set_exception(OSError("No space left on device"))
+            storage.shard_of(recipient)._append_line = lambda data, size=1: failed
+            # The batch is durable in the cross-shard log, so the transfer succeeds
+            ledger.transfer("user0", recipient, "5.00")
+        finally:
+            ledger.close()
+        ledger = open_ledger(self.path)
+        try:
+            self.assertEqual(ledger.balance(recipient), INITIAL + 500)
+            self.assert_consistent(ledger)
+        finally:
+            ledger.close()
+
+    def test_killed_owner_with_running_workers(self):
+        for _ in range(3):
+            owner = subprocess.Popen([sys.executable, "-c", OWNER, ROOT, self.path],
+                                     stdout=subprocess.DEVNULL, start_new_session=True)
+            try:
+                # Sometimes while it recovers the shards, sometimes while it compacts
+                time.sleep(random.uniform(0.3, 1.5))
+                # Only the owner dies; its pool workers finish whatever they were doing
+                owner.send_signal(signal.SIGKILL)
+                owner.wait()
+                ledger = open_ledger(self.path)
+                try:
+                    self.assert_consistent(ledger)
+                finally:
+                    ledger.close()
+            finally:
+                # The orphaned workers share the owner's session
+                try:
+                    os.killpg(owner.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def files(self):
+        """Contents of the store's files, except its temporary files"""
+        contents = {}
+        for name in os.listdir(self.directory.name):
+            if not name.endswith(".tmp"):
+                with open(os.path.join(self.directory.name, name), 'rb') as f:
+                    contents[name] = f.read()
+        return contents
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+"""Migration of older data files and recovery of torn write-ahead logs
+
+Run with: python -m unittest discover tests
+"""
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import Ledger  # noqa: E402
+from passwords import PasswordHasher  # noqa: E402
+from stats import LIFETIME  # noqa: E402
+from storage import JsonStorage, SqliteStorage, log_file_of  # noqa: E402
+
+# Accounts as the float-rupee versions of the app stored them
+LEGACY_ACCOUNTS = {
+    'alice': {'password': "secret1", 'balance': 150.3, 'transactions': [
+        {'type': 'Initial Deposit', 'amount': 100.1, 'date': "2024-01-05 10:00:00",
+         'balance': 100.1},
+        {'type': 'Deposit', 'amount': 50.2, 'date': "2024-02-01 09:30:00", 'balance': 150.3},
+    ]},
+    'bob': {'password': "secret2", 'balance': 0.07, 'transactions': [
+        {'type': 'Initial Deposit', 'amount': 100.0, 'date': "2024-01-06 11:00:00",
+         'balance': 100.0},
+        {'type': 'Withdrawal', 'amount': 99.93, 'date': "2024-03-01 12:00:00",
+         'balance': 0.07},
+    ]},
+}
+# The same accounts in paise
+EXPECTED = {
+    'alice': (15030, [(10010, 10010), (5020, 15030)]),
+    'bob': (7, [(10000, 10000), (9993, 7)]),
+}
+
+
+def open_ledger(storage):
+    """Open a ledger on storage with cheap password hashing"""
+    ledger = Ledger(storage, PasswordHasher(iterations=1000))
+    ledger.load()
+    return ledger
+
+
+class StorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def assert_migrated(self, ledger):
+        """The legacy accounts hold exact paise, rollups and checkpoints that audit clean"""
+        for username, (balance, rows) in EXPECTED.items():
+            self.assertEqual(ledger.balance(username), balance)
+            history = ledger.history(username)
+            self.assertEqual([(row['amount'], row['balance']) for row in history], rows)
+            self.assertTrue(all(isinstance(row['amount'], int) for row in history))
+            self.assertEqual(ledger.stats(username, LIFETIME)['count'], len(rows))
+            self.assertEqual(ledger.audit(username, full=True), [])
+
+
+class JsonMigrationTest(StorageTestCase):
+
+    def test_float_snapshot(self):
+        for indent in (2, None):
+            with self.subTest(indent=indent):
+                path = self.path(f"bank{indent}.json")
+                with open(path, 'w') as f:
+                    json.dump(LEGACY_ACCOUNTS, f, indent=indent)
+                ledger = open_ledger(JsonStorage(path))
+                try:
+                    self.assert_migrated(ledger)
+                    ledger.deposit('bob', "0.93")
+                    ledger.compact()
+                finally:
+                    ledger.close()
+                ledger = open_ledger(JsonStorage(path))
+                try:
+                    self.assertEqual(ledger.balance('bob'), 100)
+                    self.assertEqual(ledger.audit('bob', full=True), [])
+                finally:
+                    ledger.close()
+
+    def test_float_log_records(self):
+        path = self.path("bank.json")
+        with open(path, 'w') as f:
+            json.dump({}, f)
+        with open(log_file_of(path), 'w') as f:
+            f.write(json.dumps({'op': 'register', 'user': 'alice', 'account': {
+                'password': "secret1", 'balance': 100.1,
+                'transactions': LEGACY_ACCOUNTS['alice']['transactions'][:1]}}) + '\n')
+            f.write(json.dumps({'op': 'transaction', 'user': 'alice', 'seq': 1,
+                                'transaction': LEGACY_ACCOUNTS['alice']['transactions'][1]}) + '\n')
+        ledger = open_ledger(JsonStorage(path))
+        try:
+            self.assertEqual(ledger.balance('alice'), 15030)
+            self.assertEqual([row['amount'] for row in ledger.history('alice')], [10010, 5020])
+            self.assertEqual(ledger.audit('alice', full=True), [])
+        finally:
+            ledger.close()
+
+
+class SqliteMigrationTest(StorageTestCase):
+
+    def test_version_0_database(self):
+        path = self.path("bank.db")
+        conn = sqlite3.connect(path)
+        with conn:
+            conn.executescript("""
+                CREATE TABLE accounts (username TEXT PRIMARY KEY, password TEXT NOT NULL,
+                                       balance REAL NOT NULL);
+                CREATE TABLE transactions (id INTEGER PRIMARY KEY,
+                                           username TEXT NOT NULL REFERENCES accounts(username),
+                                           type TEXT NOT NULL, amount REAL NOT NULL,
+                                           date TEXT NOT NULL, balance REAL NOT NULL);
+                CREATE INDEX idx_transactions_username ON transactions (username);
+            """)
+            for username, account in LEGACY_ACCOUNTS.items():
+                conn.execute("INSERT INTO accounts VALUES (?, ?, ?)",
+                             (username, account['password'], account['balance']))
+                conn.executemany(
+                    "INSERT INTO transactions (username, type, amount, date, balance) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(username, row['type'], row['amount'], row['date'], row['balance'])
+                     for row in account['transactions']])
+        conn.close()
+
+        ledger = open_ledger(SqliteStorage(path))
+        try:
+            self.assert_migrated(ledger)
+            ledger.deposit('bob', "0.93")
+        finally:
+            ledger.close()
+        conn = sqlite3.connect(path)
+        try:
+            self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0],
+                             SqliteStorage.SCHEMA_VERSION)
+            self.assertEqual(conn.execute("SELECT typeof(balance) FROM accounts "
+                                          "GROUP BY 1").fetchall(), [('integer',)])
+        finally:
+            conn.close()
+        ledger = open_ledger(SqliteStorage(path))
+        try:
+            self.assertEqual(ledger.balance('bob'), 100)
+            self.assertEqual(ledger.audit('bob', full=True), [])
+        finally:
+            ledger.close()
+
+
+class TornLogTest(StorageTestCase):
+
+    def test_torn_final_record_is_dropped(self):
+        path = self.path("bank.json")
+        ledger = open_ledger(JsonStorage(path))
+        try:
+            ledger.register('alice', "secret1", "100")
+            for _ in range(3):
+                ledger.deposit('alice', "1.50")
+        finally:
+            ledger.close()
+        log_file = log_file_of(path)
+        complete = os.path.getsize(log_file)
+        # A crash in the middle of appending a deposit
+        with open(log_file, 'ab') as f:
+            f.write(b'{"op":"transaction","user":"alice","seq":4,"transac')
+
+        ledger = open_ledger(JsonStorage(path))
+        try:
+            self.assertEqual(os.path.getsize(log_file), complete)
+            self.assertEqual(ledger.balance('alice'), 10450)
+            ledger.deposit('alice', "0.50")
+        finally:
+            ledger.close()
+        ledger = open_ledger(JsonStorage(path))
+        try:
+            self.assertEqual(ledger.balance('alice'), 10500)
+            self.assertEqual(len(ledger.history('alice')), 5)
+            self.assertEqual(ledger.audit('alice', full=True), [])
+        finally:
+            ledger.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Background writer: run ledger writes on one thread behind a bounded queue
+
+A durable write waits for a disk sync, a compaction rewrites the whole data
+file and a remote ledger waits on the network, so none of them may run inside a
+Tk event callback without freezing the window. The UI hands such work to a
+BackgroundWriter instead and polls the returned Future from root.after.
+
+The queue is bounded: once max_pending writes are queued, submit raises
+queue.Full straight away rather than blocking the caller, so a stalled disk
+shows up as an error instead of a hung UI.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+
+from metrics import REGISTRY, WRITER_QUEUE_DEPTH
+
+
+class BackgroundWriter:
+    """Run submitted functions one at a time, in order, on a background thread"""
+
+    def __init__(self, max_pending=32, name="writer"):
+        self.max_pending = max_pending
+        self.completed = 0
+        self._name = name
+        self._queue = queue.Queue(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    @property
+    def queue_depth(self):
+        """Number of writes queued or running"""
+        return self._pending
+
+    def submit(self, function, *args):
+        """Queue function(*args) and return a Future of its result; raise queue.Full when full"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise ValueError("Background writer is closed")
+            self._queue.put_nowait((function, args, future))
+            self._pending += 1
+            self._publish()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+        return future
+
+    def close(self):
+        """Finish every queued write and stop the writer thread"""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _publish(self):
+        """Export the queue depth as a gauge when metrics are on"""
+        if REGISTRY.enabled:
+            REGISTRY.set(WRITER_QUEUE_DEPTH, self._pending, writer=self._name)
+
+    def _run(self):
+        """Writer loop: run queued functions and settle their futures"""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            function, args, future = job
+            running = future.set_running_or_notify_cancel()
+            result = error = None
+            if running:
+                try:
+                    result = function(*args)
+                except BaseException as e:
+                    error = e
+            # Leave the queue before settling, so a poller that sees the future
+            # done also sees the depth without it
+            with self._lock:
+                self._pending -= 1
+                self.completed += 1
+                self._publish()
+            if not running:
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)